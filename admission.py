@@ -0,0 +1,223 @@
+import json
+import os
+import shutil
+import subprocess
+import threading
+import time
+from typing import Callable, Dict, List, Optional
+
+from deploy_jobs import worker_dead, worker_id
+from shared_state import SharedState, open_state
+
+GIB = 1024 ** 3
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS build_slots (
+    seq INTEGER PRIMARY KEY AUTOINCREMENT,
+    job_id TEXT NOT NULL UNIQUE,
+    worker TEXT NOT NULL,
+    running INTEGER NOT NULL DEFAULT 0,
+    enqueued REAL NOT NULL,
+    admitted REAL,
+    hold_reasons TEXT NOT NULL DEFAULT '[]'
+);
+"""
+
+
+def read_first_line(path: str) -> Optional[str]:
+    try:
+        with open(path, 'r') as f:
+            return f.readline().strip()
+    except OSError:
+        return None
+
+
+def load_per_cpu() -> Optional[float]:
+    """1-minute load average divided by the CPU count (None where there is no load average)"""
+    if not hasattr(os, 'getloadavg'):
+        return None
+    return os.getloadavg()[0] / (os.cpu_count() or 1)
+
+
+def memory_pressure() -> Optional[float]:
+    """PSI 'some' avg10 for memory: % of the last 10s in which tasks stalled on memory"""
+    line = read_first_line('/proc/pressure/memory')
+    if not line or not line.startswith('some '):
+        return None
+    fields = dict(part.split('=', 1) for part in line.split()[1:])
+    return float(fields['avg10'])
+
+
+def memory_available() -> Optional[float]:
+    """Fraction of memory still available, from the cgroup limit when there is one, else /proc/meminfo"""
+    # cgroup v2, then v1
+    for limit_path, usage_path in (('/sys/fs/cgroup/memory.max', '/sys/fs/cgroup/memory.current'),
+                                   ('/sys/fs/cgroup/memory/memory.limit_in_bytes',
+                                    '/sys/fs/cgroup/memory/memory.usage_in_bytes')):
+        limit, usage = read_first_line(limit_path), read_first_line(usage_path)
+        # "max" or a huge v1 value means unlimited: fall through to the host numbers
+        if limit and usage and limit.isdigit() and int(limit) < 2 ** 60:
+            return max(0.0, 1 - int(usage) / int(limit))
+    try:
+        with open('/proc/meminfo', 'r') as f:
+            meminfo = {line.split(':')[0]: int(line.split()[1]) for line in f if line.split()[1:2]}
+        return meminfo['MemAvailable'] / meminfo['MemTotal']
+    except (OSError, KeyError, ValueError):
+        return None
+
+
+class AdmissionController:
+    """Holds builds until the host has room for them.
+
+    Builds wait in FIFO order. The head of the queue is admitted once load
+    per CPU, memory pressure (PSI), available memory (cgroup limit or host)
+    and free disk under the Docker data root are all within their limits.
+    After an admission the next build also waits `settle` seconds, so the
+    previous build can show up in the load average before another starts.
+
+    The queue and the running builds live in the shared SQLite state, so the
+    order, the concurrency cap and /build-queue cover every worker process
+    on the host. Slots of workers that died are dropped.
+    """
+
+    def __init__(self, max_load_per_cpu: float = 1.5, max_memory_pressure: float = 10.0,
+                 min_memory_available: float = 0.15, min_free_disk: int = 5 * GIB, max_concurrent: int = 0,
+                 settle: float = 15.0, poll_interval: float = 2.0, docker_cmd: str = 'docker',
+                 state: Optional[SharedState] = None):
+        self.max_load_per_cpu = max_load_per_cpu
+        self.max_memory_pressure = max_memory_pressure
+        self.min_memory_available = min_memory_available
+        self.min_free_disk = min_free_disk
+        self.max_concurrent = max_concurrent
+        self.settle = settle
+        self.poll_interval = poll_interval
+        self.docker_cmd = docker_cmd
+        self.state = state or open_state()
+        self.state.connection().executescript(SCHEMA)
+        # Wakes this process's waiters early on a local release; other workers are seen at the next poll
+        self.condition = threading.Condition()
+        self._docker_root = None
+
+    def docker_root(self) -> str:
+        """Docker data root (asked once), or the closest existing directory we can stat"""
+        if self._docker_root is None:
+            root = '/var/lib/docker'
+            try:
+                result = subprocess.run([self.docker_cmd, 'info', '--format', '{{.DockerRootDir}}'],
+                                        capture_output=True, text=True, timeout=10)
+                if result.returncode == 0 and result.stdout.strip():
+                    root = result.stdout.strip()
+            except (OSError, subprocess.TimeoutExpired):
+                pass
+            self._docker_root = root
+        path = self._docker_root
+        while not os.path.isdir(path) and os.path.dirname(path) != path:
+            path = os.path.dirname(path)
+        return path
+
+    def sample(self) -> Dict:
+        try:
+            disk_free = shutil.disk_usage(self.docker_root()).free
+        except OSError:
+            disk_free = None
+        return {
+            'load_per_cpu': load_per_cpu(),
+            'memory_pressure': memory_pressure(),
+            'memory_available': memory_available(),
+            'disk_free': disk_free
+        }
+
+    def _drop_dead_workers(self, conn):
+        workers = [row[0] for row in conn.execute('SELECT DISTINCT worker FROM build_slots')]
+        for worker in workers:
+            if worker_dead(worker):
+                conn.execute('DELETE FROM build_slots WHERE worker = ?', (worker,))
+
+    def hold_reasons(self, conn, sample: Dict) -> List[str]:
+        """Why a build cannot start now (empty when it can); conn is the caller's transaction"""
+        running, last_admitted = conn.execute(
+            'SELECT COUNT(*), MAX(admitted) FROM build_slots WHERE running = 1').fetchone()
+        reasons = []
+        if self.max_concurrent and running >= self.max_concurrent:
+            reasons.append(f"{running} build(s) running (limit {self.max_concurrent})")
+        if running and time.time() - last_admitted < self.settle:
+            reasons.append(f"letting the last admitted build settle ({self.settle:g}s)")
+        if sample['load_per_cpu'] is not None and sample['load_per_cpu'] > self.max_load_per_cpu:
+            reasons.append(f"load {sample['load_per_cpu']:.2f} per CPU > {self.max_load_per_cpu:g}")
+        if sample['memory_pressure'] is not None and sample['memory_pressure'] > self.max_memory_pressure:
+            reasons.append(f"memory pressure {sample['memory_pressure']:.1f}% > {self.max_memory_pressure:g}%")
+        if sample['memory_available'] is not None and sample['memory_available'] < self.min_memory_available:
+            reasons.append(f"{sample['memory_available']:.0%} memory available < {self.min_memory_available:.0%}")
+        if sample['disk_free'] is not None and sample['disk_free'] < self.min_free_disk:
+            reasons.append(f"{sample['disk_free'] / GIB:.1f} GiB free under {self.docker_root()} "
+                           f"< {self.min_free_disk / GIB:g} GiB")
+        return reasons
+
+    def acquire(self, job, log: Callable[[str], None] = print):
+        """Block until job may build. job needs job_id, check() (raises when it is aborted) and set_hold()"""
+        self.state.connection().execute('INSERT INTO build_slots (job_id, worker, enqueued) VALUES (?, ?, ?)',
+                                        (job.job_id, worker_id(), time.time()))
+        held = None
+        try:
+            while True:
+                job.check()
+                sample = self.sample()
+                with self.state.transaction() as conn:
+                    self._drop_dead_workers(conn)
+                    position = conn.execute(
+                        'SELECT COUNT(*) FROM build_slots WHERE running = 0 '
+                        'AND seq < (SELECT seq FROM build_slots WHERE job_id = ?)', (job.job_id,)).fetchone()[0]
+                    if position:
+                        reasons = [f"{position} build(s) ahead in the queue"]
+                    else:
+                        reasons = self.hold_reasons(conn, sample)
+                    conn.execute('UPDATE build_slots SET running = ?, admitted = ?, hold_reasons = ? WHERE job_id = ?',
+                                 (0 if reasons else 1, None if reasons else time.time(), json.dumps(reasons),
+                                  job.job_id))
+                if not reasons:
+                    break
+                if reasons != held:
+                    held = reasons
+                    job.set_hold(position + 1, reasons)
+                    log(f"⏳ Build queued at position {position + 1}: {'; '.join(reasons)}")
+                with self.condition:
+                    self.condition.wait(self.poll_interval)
+        except BaseException:
+            self.release(job.job_id)
+            if held:
+                job.set_hold(None, [])
+            raise
+        with self.condition:
+            self.condition.notify_all()
+        if held:
+            job.set_hold(None, [])
+            log("✅ Build admitted")
+
+    def release(self, job_id: str):
+        """The job's build is over, or it left the queue (safe to call more than once)"""
+        if self.state.connection().execute('DELETE FROM build_slots WHERE job_id = ?', (job_id,)).rowcount:
+            with self.condition:
+                self.condition.notify_all()
+
+    def status(self) -> Dict:
+        sample = self.sample()
+        with self.state.transaction() as conn:
+            self._drop_dead_workers(conn)
+            rows = conn.execute('SELECT job_id, worker, running, hold_reasons FROM build_slots ORDER BY seq').fetchall()
+            hold_reasons = self.hold_reasons(conn, sample)
+        queued = [row for row in rows if not row[2]]
+        return {
+            'queue': [{'job_id': job_id, 'worker': worker, 'position': i + 1, 'hold_reasons': json.loads(reasons)}
+                      for i, (job_id, worker, _, reasons) in enumerate(queued)],
+            'running': [row[0] for row in rows if row[2]],
+            'sample': sample,
+            'hold_reasons': hold_reasons,
+            'limits': {
+                'max_load_per_cpu': self.max_load_per_cpu,
+                'max_memory_pressure': self.max_memory_pressure,
+                'min_memory_available': self.min_memory_available,
+                'min_free_disk': self.min_free_disk,
+                'max_concurrent': self.max_concurrent,
+                'settle': self.settle
+            }
+        }
@@ -0,0 +1,303 @@
+import gzip
+import hashlib
+import json
+import os
+import shutil
+import subprocess
+import tarfile
+import tempfile
+import threading
+from contextlib import contextmanager
+from datetime import datetime
+from typing import Callable, Dict, List, Optional
+
+try:
+    import fcntl
+except ImportError:
+    # Windows: no flock, and no pre-forking server either, so the thread lock is enough
+    fcntl = None
+
+OCI_MANIFEST = 'application/vnd.oci.image.manifest.v1+json'
+OCI_CONFIG = 'application/vnd.oci.image.config.v1+json'
+LAYER_ZSTD = 'application/vnd.oci.image.layer.v1.tar+zstd'
+LAYER_GZIP = 'application/vnd.oci.image.layer.v1.tar+gzip'
+REF_ANNOTATION = 'org.opencontainers.image.ref.name'
+CHUNK = 1024 * 1024
+
+
+def sha256_file(path: str) -> str:
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(CHUNK), b''):
+            digest.update(chunk)
+    return 'sha256:' + digest.hexdigest()
+
+
+class ArtifactStore:
+    """Content-addressed OCI image layout holding built images for offline redeploys.
+
+    Layers are stored zstd-compressed (gzip when the zstd CLI is missing) and
+    deduplicated by their uncompressed digest, so versions that share base
+    layers only pay for them once. Images are evicted least recently used
+    first once the store grows past max_bytes.
+
+    Several worker processes can share a store: index.json and diff_ids.json
+    updates, loads and garbage collection hold an flock on the store's lock
+    file as well as the thread lock.
+    """
+
+    def __init__(self, root: str, max_bytes: int = 10 * 1024 ** 3, docker_cmd: str = 'docker'):
+        self.root = root
+        self.max_bytes = max_bytes
+        self.docker_cmd = docker_cmd
+        self.lock = threading.Lock()
+        self.blobs_dir = os.path.join(root, 'blobs', 'sha256')
+        os.makedirs(self.blobs_dir, exist_ok=True)
+        layout_file = os.path.join(root, 'oci-layout')
+        if not os.path.exists(layout_file):
+            with open(layout_file, 'w') as f:
+                json.dump({'imageLayoutVersion': '1.0.0'}, f)
+
+    @contextmanager
+    def _locked(self):
+        """Exclusive use of the store against other threads and other processes"""
+        with self.lock, open(os.path.join(self.root, '.lock'), 'a') as lock_file:
+            if fcntl:
+                fcntl.flock(lock_file, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                if fcntl:
+                    fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    # Index and blob helpers
+
+    def _index_path(self) -> str:
+        return os.path.join(self.root, 'index.json')
+
+    def _load_index(self) -> Dict:
+        if os.path.exists(self._index_path()):
+            with open(self._index_path(), 'r') as f:
+                return json.load(f)
+        return {'schemaVersion': 2, 'manifests': []}
+
+    def _save_index(self, index: Dict):
+        temp_path = self._index_path() + '.tmp'
+        with open(temp_path, 'w') as f:
+            json.dump(index, f, indent=2)
+        os.replace(temp_path, self._index_path())
+
+    def _diff_ids_path(self) -> str:
+        # Uncompressed layer digest -> stored (compressed) blob descriptor
+        return os.path.join(self.root, 'diff_ids.json')
+
+    def _load_diff_ids(self) -> Dict:
+        if os.path.exists(self._diff_ids_path()):
+            with open(self._diff_ids_path(), 'r') as f:
+                return json.load(f)
+        return {}
+
+    def blob_path(self, digest: str) -> str:
+        return os.path.join(self.blobs_dir, digest.split(':', 1)[1])
+
+    def _add_blob(self, source_path: str) -> Dict:
+        """Move a file into the blob store; returns digest and size"""
+        digest = sha256_file(source_path)
+        size = os.path.getsize(source_path)
+        target = self.blob_path(digest)
+        if os.path.exists(target):
+            os.unlink(source_path)
+        else:
+            os.replace(source_path, target)
+        return {'digest': digest, 'size': size}
+
+    def _add_json_blob(self, data: Dict, work_dir: str) -> Dict:
+        fd, path = tempfile.mkstemp(dir=work_dir)
+        with os.fdopen(fd, 'w') as f:
+            json.dump(data, f, separators=(',', ':'))
+        return self._add_blob(path)
+
+    def _compress(self, source_path: str, work_dir: str) -> Dict:
+        """Compress a layer tar with zstd (or gzip as fallback) into the blob store"""
+        fd, target = tempfile.mkstemp(dir=work_dir)
+        os.close(fd)
+        if shutil.which('zstd'):
+            subprocess.run(['zstd', '-q', '-f', '-T0', '-3', source_path, '-o', target], check=True)
+            media_type = LAYER_ZSTD
+        else:
+            with open(source_path, 'rb') as src, gzip.open(target, 'wb', compresslevel=6) as dst:
+                shutil.copyfileobj(src, dst, CHUNK)
+            media_type = LAYER_GZIP
+        descriptor = self._add_blob(target)
+        descriptor['mediaType'] = media_type
+        return descriptor
+
+    def _decompress(self, descriptor: Dict, target_path: str):
+        source = self.blob_path(descriptor['digest'])
+        if descriptor['mediaType'] == LAYER_ZSTD:
+            subprocess.run(['zstd', '-q', '-d', '-f', source, '-o', target_path], check=True)
+        else:
+            with gzip.open(source, 'rb') as src, open(target_path, 'wb') as dst:
+                shutil.copyfileobj(src, dst, CHUNK)
+
+    # Public API
+
+    def store(self, image_ref: str, run: Callable = subprocess.run) -> Dict:
+        """Export a local image with docker save and add it to the store; returns the manifest descriptor"""
+        with self._locked():
+            work_dir = tempfile.mkdtemp(dir=self.root, prefix='.work-')
+            try:
+                archive = os.path.join(work_dir, 'image.tar')
+                run([self.docker_cmd, 'save', '-o', archive, image_ref], check=True, capture_output=True)
+                extract_dir = os.path.join(work_dir, 'image')
+                with tarfile.open(archive) as tar:
+                    if hasattr(tarfile, 'data_filter'):
+                        tar.extractall(extract_dir, filter='data')
+                    else:
+                        tar.extractall(extract_dir)
+                os.unlink(archive)
+
+                with open(os.path.join(extract_dir, 'manifest.json'), 'r') as f:
+                    save_manifest = json.load(f)[0]
+
+                diff_ids = self._load_diff_ids()
+                layers = []
+                new_bytes = 0
+                for layer_path in save_manifest['Layers']:
+                    full_path = os.path.join(extract_dir, layer_path)
+                    diff_id = sha256_file(full_path)
+                    if diff_id in diff_ids and os.path.exists(self.blob_path(diff_ids[diff_id]['digest'])):
+                        descriptor = dict(diff_ids[diff_id])
+                    else:
+                        descriptor = self._compress(full_path, work_dir)
+                        descriptor['annotations'] = {'io.deploy-tool.diff-id': diff_id,
+                                                     'io.deploy-tool.uncompressed-size': str(os.path.getsize(full_path))}
+                        diff_ids[diff_id] = descriptor
+                        new_bytes += descriptor['size']
+                    layers.append(descriptor)
+
+                config_path = os.path.join(work_dir, 'config.json')
+                shutil.copyfile(os.path.join(extract_dir, save_manifest['Config']), config_path)
+                config = self._add_blob(config_path)
+                config['mediaType'] = OCI_CONFIG
+
+                manifest = self._add_json_blob({
+                    'schemaVersion': 2,
+                    'mediaType': OCI_MANIFEST,
+                    'config': config,
+                    'layers': layers
+                }, work_dir)
+                manifest['mediaType'] = OCI_MANIFEST
+                now = datetime.now().isoformat()
+                manifest['annotations'] = {REF_ANNOTATION: image_ref, 'io.deploy-tool.stored': now,
+                                           'io.deploy-tool.last-used': now}
+
+                with open(self._diff_ids_path(), 'w') as f:
+                    json.dump(diff_ids, f, indent=2)
+                index = self._load_index()
+                index['manifests'] = [m for m in index['manifests']
+                                      if m['annotations'].get(REF_ANNOTATION) != image_ref]
+                index['manifests'].append(manifest)
+                self._save_index(index)
+                self._evict(keep=manifest['digest'])
+                return dict(manifest, new_bytes=new_bytes)
+            finally:
+                shutil.rmtree(work_dir, ignore_errors=True)
+
+    def has(self, digest: str) -> bool:
+        return any(m['digest'] == digest for m in self._load_index()['manifests'])
+
+    def load(self, digest: str) -> str:
+        """docker load an image from the store without touching the network; returns its reference"""
+        with self._locked():
+            index = self._load_index()
+            entry = next((m for m in index['manifests'] if m['digest'] == digest), None)
+            if entry is None:
+                raise KeyError(f"Artifact {digest} is not in the store")
+            with open(self.blob_path(digest), 'r') as f:
+                manifest = json.load(f)
+
+            image_ref = entry['annotations'][REF_ANNOTATION]
+            work_dir = tempfile.mkdtemp(dir=self.root, prefix='.work-')
+            try:
+                # Rebuild a docker save archive, which every docker version can load
+                archive = os.path.join(work_dir, 'image.tar')
+                with tarfile.open(archive, 'w') as tar:
+                    layer_names = []
+                    for i, layer in enumerate(manifest['layers']):
+                        layer_file = os.path.join(work_dir, f'layer{i}.tar')
+                        self._decompress(layer, layer_file)
+                        name = f"{layer['digest'].split(':', 1)[1]}/layer.tar"
+                        tar.add(layer_file, arcname=name)
+                        os.unlink(layer_file)
+                        layer_names.append(name)
+                    config_name = manifest['config']['digest'].split(':', 1)[1] + '.json'
+                    tar.add(self.blob_path(manifest['config']['digest']), arcname=config_name)
+                    manifest_file = os.path.join(work_dir, 'manifest.json')
+                    with open(manifest_file, 'w') as f:
+                        json.dump([{'Config': config_name, 'RepoTags': [image_ref], 'Layers': layer_names}], f)
+                    tar.add(manifest_file, arcname='manifest.json')
+
+                subprocess.run([self.docker_cmd, 'load', '-i', archive], check=True, capture_output=True)
+            finally:
+                shutil.rmtree(work_dir, ignore_errors=True)
+
+            entry['annotations']['io.deploy-tool.last-used'] = datetime.now().isoformat()
+            self._save_index(index)
+            return image_ref
+
+    def list_artifacts(self) -> List[Dict]:
+        # Not locked, so it does not wait behind a docker save: an image evicted meanwhile is skipped
+        artifacts = []
+        for entry in self._load_index()['manifests']:
+            manifest = self._load_manifest(entry['digest'])
+            if manifest is None:
+                continue
+            artifacts.append({
+                'digest': entry['digest'],
+                'image': entry['annotations'].get(REF_ANNOTATION),
+                'stored': entry['annotations'].get('io.deploy-tool.stored'),
+                'last_used': entry['annotations'].get('io.deploy-tool.last-used'),
+                'size': sum(layer['size'] for layer in manifest['layers']) + manifest['config']['size']
+            })
+        return artifacts
+
+    def _load_manifest(self, digest: str) -> Optional[Dict]:
+        """A stored manifest, None if its blob is gone"""
+        try:
+            with open(self.blob_path(digest), 'r') as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return None
+
+    def total_size(self) -> int:
+        return sum(entry.stat().st_size for entry in os.scandir(self.blobs_dir))
+
+    def _evict(self, keep: Optional[str] = None):
+        """Drop least recently used images until the blobs fit in max_bytes"""
+        index = self._load_index()
+        while self.total_size() > self.max_bytes:
+            candidates = [m for m in index['manifests'] if m['digest'] != keep]
+            if not candidates:
+                break
+            oldest = min(candidates, key=lambda m: m['annotations'].get('io.deploy-tool.last-used', ''))
+            index['manifests'].remove(oldest)
+            self._save_index(index)
+            self._collect_garbage(index)
+
+    def _collect_garbage(self, index: Dict):
+        """Delete blobs no longer referenced by any stored manifest"""
+        referenced = set()
+        for entry in index['manifests']:
+            manifest = self._load_manifest(entry['digest'])
+            if manifest is None:
+                continue
+            referenced.add(entry['digest'])
+            referenced.add(manifest['config']['digest'])
+            referenced.update(layer['digest'] for layer in manifest['layers'])
+        for blob in os.scandir(self.blobs_dir):
+            if 'sha256:' + blob.name not in referenced:
+                os.unlink(blob.path)
+        diff_ids = {diff_id: d for diff_id, d in self._load_diff_ids().items() if d['digest'] in referenced}
+        with open(self._diff_ids_path(), 'w') as f:
+            json.dump(diff_ids, f, indent=2)
@@ -0,0 +1,175 @@
+"""Remote build agent.
+
+Run one or more of these next to (or away from) the web app:
+
+    python build_agent.py --port 9101 --coordinator http://127.0.0.1:9999 --capacity 2
+
+The agent registers with the coordinator, heartbeats its load, and runs the
+clone/build/push of each job it receives, streaming log lines back as NDJSON.
+"""
+import argparse
+import hmac
+import json
+import os
+import shutil
+import socket
+import subprocess
+import tempfile
+import threading
+import time
+
+import requests
+from flask import Flask, request
+
+from image_metrics import measure_image
+from registry_push import push_to_registries
+
+app = Flask(__name__)
+
+agent_state = {
+    'agent_id': '',
+    'capacity': 1,
+    'active': 0,
+    'token': os.environ.get('BUILD_AGENT_TOKEN', ''),
+    'docker_cmd': os.environ.get('DOCKER_CMD', 'docker')
+}
+state_lock = threading.Lock()
+
+
+def run_streamed(command, input_text=None, cwd=None):
+    """Run a command and yield its combined output line by line; raises on a non-zero exit"""
+    process = subprocess.Popen(command, cwd=cwd, stdin=subprocess.PIPE if input_text else None,
+                               stdout=subprocess.PIPE, stderr=subprocess.STDOUT, text=True)
+    if input_text:
+        try:
+            process.stdin.write(input_text)
+            process.stdin.close()
+        except BrokenPipeError:
+            # The command exited without reading its input; its exit code tells the rest
+            pass
+    try:
+        for line in process.stdout:
+            yield line.rstrip()
+    finally:
+        # The coordinator went away (deploy cancelled or timed out): stop the command too
+        if process.poll() is None:
+            process.terminate()
+    if process.wait() != 0:
+        raise subprocess.CalledProcessError(process.returncode, command[:2])
+
+
+def run_docker(args, **kwargs):
+    """subprocess.run for the registry push helpers, with this agent's docker binary"""
+    if args and args[0] == 'docker':
+        args = [agent_state['docker_cmd']] + list(args[1:])
+    return subprocess.run(args, **kwargs)
+
+
+def run_build(job):
+    """Clone, build and push one job, yielding NDJSON messages"""
+    def log(message):
+        return json.dumps({'type': 'log', 'message': message}) + '\n'
+
+    docker = agent_state['docker_cmd']
+    temp_dir = tempfile.mkdtemp(prefix='build-agent-')
+    try:
+        yield log(f"📥 Cloning {job['clone_url']}")
+        for line in run_streamed(['git', 'clone', '--depth', '1', job['clone_url'], temp_dir]):
+            yield log(line)
+
+        yield log(f"🔨 Building {job['image_name']}")
+        build_output = []
+        for line in run_streamed([docker, 'build', '-t', job['image_name'], '.'], cwd=temp_dir):
+            build_output.append(line)
+            yield log(line)
+
+        # Size and layers for the coordinator's growth check; a build is not failed for lacking them
+        try:
+            image_metrics = measure_image(job['image_name'], docker_cmd=docker)
+        except Exception as e:
+            image_metrics = None
+            yield log(f"⚠️ Could not measure {job['image_name']}: {e}")
+
+        if job.get('push', True):
+            yield log("🔐 Logging in to registry...")
+            registry = job['image_name'].split('/')[0]
+            for line in run_streamed([docker, 'login', registry, '-u', job['registry_username'], '--password-stdin'],
+                                     input_text=job['registry_password']):
+                yield log(line)
+            # Same push as a local build: the extra registries at the same time, each verified by digest
+            yield log(f"📦 Pushing {job['image_name']}")
+            # The coordinator logs each push from the result
+            pushes = push_to_registries(job['image_name'], job.get('extra_registries', []), run_docker)
+            if not pushes[0]['ok']:
+                raise RuntimeError(f"Push of {job['image_name']} failed: {pushes[0]['error']}")
+        else:
+            pushes = []
+
+        yield json.dumps({'type': 'result', 'ok': True, 'build_output': '\n'.join(build_output),
+                          'image_metrics': image_metrics, 'pushes': pushes}) + '\n'
+    except Exception as e:
+        yield json.dumps({'type': 'result', 'ok': False, 'error': str(e)}) + '\n'
+    finally:
+        shutil.rmtree(temp_dir, ignore_errors=True)
+
+
+def release_slot():
+    with state_lock:
+        agent_state['active'] -= 1
+
+
+@app.route('/build', methods=['POST'])
+def build():
+    if not hmac.compare_digest(request.headers.get('X-Agent-Token', '').encode(), agent_state['token'].encode()):
+        return json.dumps({'error': 'Invalid agent token'}), 403
+    with state_lock:
+        if agent_state['active'] >= agent_state['capacity']:
+            return json.dumps({'error': 'Agent at capacity'}), 429
+        agent_state['active'] += 1
+    job = request.get_json()
+    response = app.response_class(run_build(job), mimetype='application/x-ndjson')
+    # Runs even if the coordinator disconnects before the stream starts
+    response.call_on_close(release_slot)
+    return response
+
+
+@app.route('/status')
+def status():
+    with state_lock:
+        return {'agent_id': agent_state['agent_id'], 'capacity': agent_state['capacity'], 'active': agent_state['active']}
+
+
+def heartbeat_loop(coordinator, url, interval):
+    """Register with the coordinator and keep reporting the current load"""
+    while True:
+        with state_lock:
+            payload = {'agent_id': agent_state['agent_id'], 'url': url,
+                       'capacity': agent_state['capacity'], 'active': agent_state['active']}
+        try:
+            requests.post(f"{coordinator.rstrip('/')}/agents/register", json=payload, timeout=5,
+                          headers={'X-Agent-Token': agent_state['token']})
+        except requests.exceptions.RequestException as e:
+            print(f"⚠️ Could not reach coordinator: {e}")
+        time.sleep(interval)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Remote build agent')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=9101)
+    parser.add_argument('--coordinator', default='http://127.0.0.1:9999')
+    parser.add_argument('--capacity', type=int, default=1)
+    parser.add_argument('--agent-id', default='')
+    parser.add_argument('--advertise-url', default='', help='URL the coordinator should use to reach this agent')
+    parser.add_argument('--heartbeat', type=int, default=10)
+    args = parser.parse_args()
+    # Jobs come with registry credentials: never accept them from an unauthenticated coordinator
+    if not agent_state['token']:
+        parser.error('set BUILD_AGENT_TOKEN (the same value as on the app)')
+
+    agent_state['agent_id'] = args.agent_id or f"{socket.gethostname()}-{args.port}"
+    agent_state['capacity'] = args.capacity
+    advertise_url = args.advertise_url or f"http://{args.host}:{args.port}"
+
+    threading.Thread(target=heartbeat_loop, args=(args.coordinator, advertise_url, args.heartbeat), daemon=True).start()
+    app.run(host=args.host, port=args.port, threaded=True)
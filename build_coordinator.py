@@ -0,0 +1,206 @@
+import hmac
+import json
+import socket
+import threading
+import time
+from contextlib import nullcontext
+from typing import Callable, ContextManager, Dict, List, Optional
+
+import requests
+
+from deploy_jobs import worker_dead, worker_id
+from shared_state import SharedState, open_state
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS build_agents (
+    agent_id TEXT PRIMARY KEY,
+    url TEXT NOT NULL,
+    capacity INTEGER NOT NULL,
+    active INTEGER NOT NULL DEFAULT 0,
+    last_seen REAL NOT NULL,
+    dispatched INTEGER NOT NULL DEFAULT 0,
+    recent_repos TEXT NOT NULL DEFAULT '[]'
+);
+CREATE TABLE IF NOT EXISTS agent_reservations (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    agent_id TEXT NOT NULL,
+    worker TEXT NOT NULL
+);
+"""
+
+# Agents that have not sent a heartbeat for this long are not given new jobs
+AGENT_TTL = 30
+# How many recently built repos each agent remembers for cache-locality placement
+RECENT_REPOS = 20
+
+
+def close_stream(response: requests.Response):
+    """Close a streamed response from another thread; shutting the socket down wakes a read blocked on it"""
+    sock = getattr(getattr(getattr(getattr(response.raw, '_fp', None), 'fp', None), 'raw', None), '_sock', None)
+    if sock is not None:
+        try:
+            sock.shutdown(socket.SHUT_RDWR)
+        except OSError:
+            pass
+    response.close()
+
+
+class BuildCoordinator:
+    """Registry of remote build agents and placement of build jobs on them.
+
+    Jobs carry the user's registry credentials, so agents are only used when
+    a shared agent_token is set: without one nothing can register and
+    nothing is dispatched.
+
+    Agents and their reserved slots live in the shared SQLite state, so every
+    worker process sees the same agents and the same load. Reservations of
+    workers that died are dropped.
+    """
+
+    def __init__(self, agent_token: str = '', ttl: int = AGENT_TTL, state: Optional[SharedState] = None):
+        self.agent_token = agent_token
+        self.ttl = ttl
+        self.state = state or open_state()
+        self.state.connection().executescript(SCHEMA)
+
+    @property
+    def enabled(self) -> bool:
+        return bool(self.agent_token)
+
+    def check_token(self, token: Optional[str]) -> bool:
+        """Whether token is the shared agent token (always False while agents are disabled)"""
+        return self.enabled and hmac.compare_digest((token or '').encode(), self.agent_token.encode())
+
+    def _agents(self, conn) -> List[Dict]:
+        """Every agent with its reserved slot count; conn may be the caller's transaction"""
+        rows = conn.execute(
+            'SELECT a.agent_id, a.url, a.capacity, a.active, a.last_seen, a.dispatched, a.recent_repos, '
+            '(SELECT COUNT(*) FROM agent_reservations r WHERE r.agent_id = a.agent_id) '
+            'FROM build_agents a ORDER BY a.agent_id').fetchall()
+        return [{'agent_id': agent_id, 'url': url, 'capacity': capacity, 'active': active, 'last_seen': last_seen,
+                 'dispatched': dispatched, 'recent_repos': json.loads(recent_repos), 'reserved': reserved}
+                for agent_id, url, capacity, active, last_seen, dispatched, recent_repos, reserved in rows]
+
+    def register(self, agent_id: str, url: str, capacity: int, active: int = 0) -> Dict:
+        """Add or refresh an agent; agents call this on start and as their heartbeat"""
+        with self.state.transaction() as conn:
+            conn.execute('INSERT INTO build_agents (agent_id, url, capacity, active, last_seen) VALUES (?, ?, ?, ?, ?) '
+                         'ON CONFLICT(agent_id) DO UPDATE SET url = excluded.url, capacity = excluded.capacity, '
+                         'active = excluded.active, last_seen = excluded.last_seen',
+                         (agent_id, url.rstrip('/'), max(1, int(capacity)), int(active), time.time()))
+            return next(agent for agent in self._agents(conn) if agent['agent_id'] == agent_id)
+
+    def list_agents(self) -> List[Dict]:
+        now = time.time()
+        return [dict(agent, alive=now - agent['last_seen'] < self.ttl) for agent in self._agents(self.state.connection())]
+
+    def has_agents(self) -> bool:
+        return self.enabled and any(agent['alive'] for agent in self.list_agents())
+
+    def _load(self, agent: Dict) -> float:
+        return (max(agent['active'], 0) + agent['reserved']) / agent['capacity']
+
+    def _drop_dead_workers(self, conn):
+        workers = [row[0] for row in conn.execute('SELECT DISTINCT worker FROM agent_reservations')]
+        for worker in workers:
+            if worker_dead(worker):
+                conn.execute('DELETE FROM agent_reservations WHERE worker = ?', (worker,))
+
+    def select_agent(self, repo: str, exclude: Optional[List[str]] = None) -> Optional[Dict]:
+        """Pick a live agent with free capacity, preferring the one that last built repo, and reserve a slot on it"""
+        now = time.time()
+        with self.state.transaction() as conn:
+            self._drop_dead_workers(conn)
+            candidates = [agent for agent in self._agents(conn)
+                          if now - agent['last_seen'] < self.ttl
+                          and agent['agent_id'] not in (exclude or [])
+                          and self._load(agent) < 1]
+            if not candidates:
+                return None
+
+            def score(agent):
+                # Most recently built repos first in recent_repos; a hit beats any load difference
+                try:
+                    locality = agent['recent_repos'].index(repo)
+                except ValueError:
+                    locality = RECENT_REPOS
+                return (locality, self._load(agent))
+
+            agent = min(candidates, key=score)
+            reservation = conn.execute('INSERT INTO agent_reservations (agent_id, worker) VALUES (?, ?)',
+                                       (agent['agent_id'], worker_id())).lastrowid
+            conn.execute('UPDATE build_agents SET dispatched = dispatched + 1 WHERE agent_id = ?', (agent['agent_id'],))
+            return dict(agent, reserved=agent['reserved'] + 1, dispatched=agent['dispatched'] + 1,
+                        reservation=reservation)
+
+    def _release(self, agent: Dict, repo: str, built: bool):
+        with self.state.transaction() as conn:
+            conn.execute('DELETE FROM agent_reservations WHERE id = ?', (agent['reservation'],))
+            if built:
+                row = conn.execute('SELECT recent_repos FROM build_agents WHERE agent_id = ?',
+                                   (agent['agent_id'],)).fetchone()
+                if row:
+                    recent_repos = [r for r in json.loads(row[0]) if r != repo]
+                    recent_repos.insert(0, repo)
+                    conn.execute('UPDATE build_agents SET recent_repos = ? WHERE agent_id = ?',
+                                 (json.dumps(recent_repos[:RECENT_REPOS]), agent['agent_id']))
+
+    def dispatch(self, job: Dict, log: Callable[[str], None],
+                 cancel_event: Optional[threading.Event] = None,
+                 abort_hook: Optional[Callable[[Callable[[], None]], ContextManager]] = None) -> Optional[Dict]:
+        """Run a build job on an agent, forwarding its log lines to log.
+
+        Returns the agent's result dict, or None when no agent could take the
+        job (the caller then builds locally). Closing the stream makes the
+        agent stop the build: that happens at the next line once cancel_event
+        is set, and at once through abort_hook (DeployJob.abort_hook), so a
+        silent build step does not hold up a cancel.
+        """
+        if not self.enabled:
+            return None
+        tried = []
+
+        def is_cancelled():
+            return cancel_event is not None and cancel_event.is_set()
+
+        while True:
+            agent = self.select_agent(job['repo'], exclude=tried)
+            if agent is None:
+                return None
+            tried.append(agent['agent_id'])
+            result = None
+            try:
+                log(f"🛰️ Dispatching build to agent {agent['agent_id']} ({agent['url']})")
+                response = requests.post(f"{agent['url']}/build", json=job, stream=True, timeout=(5, 3600),
+                                         headers={'X-Agent-Token': self.agent_token})
+                if response.status_code == 429:
+                    log(f"⚠️ Agent {agent['agent_id']} is busy, trying another")
+                    continue
+                if response.status_code != 200:
+                    log(f"⚠️ Agent {agent['agent_id']} rejected the job: {response.status_code}")
+                    continue
+                with abort_hook(lambda: close_stream(response)) if abort_hook else nullcontext():
+                    for line in response.iter_lines(decode_unicode=True):
+                        if is_cancelled():
+                            break
+                        if not line:
+                            continue
+                        message = json.loads(line)
+                        if message['type'] == 'log':
+                            log(f"[{agent['agent_id']}] {message['message']}")
+                        elif message['type'] == 'result':
+                            result = dict(message, agent_id=agent['agent_id'])
+                if is_cancelled():
+                    response.close()
+                    result = {'type': 'result', 'ok': False, 'agent_id': agent['agent_id'], 'error': 'cancelled'}
+                elif result is None:
+                    result = {'type': 'result', 'ok': False, 'agent_id': agent['agent_id'],
+                              'error': 'Agent closed the stream without a result'}
+                return result
+            except requests.exceptions.RequestException as e:
+                # A stream closed by the abort hook ends here too; that is not a reason to try another agent
+                if is_cancelled():
+                    return {'type': 'result', 'ok': False, 'agent_id': agent['agent_id'], 'error': 'cancelled'}
+                log(f"⚠️ Could not reach agent {agent['agent_id']}: {e}")
+            finally:
+                self._release(agent, job['repo'], bool(result and result.get('ok')))
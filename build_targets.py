@@ -0,0 +1,133 @@
+import fnmatch
+import os
+import subprocess
+from typing import Dict, List, Optional, Tuple
+
+from git_runner import GitRunner
+from image_prefetcher import read_instructions
+
+SKIP_DIRS = {'.git', 'node_modules', '__pycache__', '.venv', 'venv'}
+
+
+# Suffixes left by editors, merges and manual backups; Dockerfile.<suffix> with these is not a build target
+NOT_DOCKERFILE_SUFFIXES = {'dockerignore', 'bak', 'backup', 'orig', 'old', 'save', 'swp', 'swo', 'tmp', 'rej', 'disabled'}
+
+
+def is_dockerfile(filename: str) -> bool:
+    """Dockerfile, Dockerfile.<name> or <name>.Dockerfile, but not .dockerignore files or backups"""
+    if filename.endswith('~'):
+        return False
+    if filename == 'Dockerfile':
+        return True
+    if filename.startswith('Dockerfile.'):
+        suffix = filename[len('Dockerfile.'):]
+        return bool(suffix) and suffix.rsplit('.', 1)[-1].lower() not in NOT_DOCKERFILE_SUFFIXES
+    return len(filename) > len('.Dockerfile') and filename.endswith('.Dockerfile')
+
+
+def parse_copy_sources(dockerfile_path: str) -> List[str]:
+    """Context-relative sources of COPY/ADD instructions (copies from other stages are skipped)"""
+    sources = []
+    for parts in read_instructions(dockerfile_path):
+        if parts[0].upper() not in ('COPY', 'ADD'):
+            continue
+        args = parts[1:]
+        if any(arg.startswith('--from') for arg in args):
+            continue
+        args = [arg for arg in args if not arg.startswith('--')]
+        if args and args[0].startswith('['):
+            # Exec form: read_instructions has already stripped the quotes
+            args = [arg.strip() for arg in ' '.join(args).strip('[]').split(',') if arg.strip()]
+        for source in args[:-1]:
+            if '://' in source:
+                continue
+            source = os.path.normpath(source.lstrip('/')).replace(os.sep, '/')
+            sources.append(source)
+    return sources
+
+
+def read_dockerignore(context_dir: str) -> List[str]:
+    path = os.path.join(context_dir, '.dockerignore')
+    if not os.path.exists(path):
+        return []
+    with open(path, 'r', encoding='utf-8', errors='replace') as f:
+        return [line.strip() for line in f if line.strip() and not line.startswith('#')]
+
+
+def is_ignored(rel_path: str, patterns: List[str]) -> bool:
+    """Apply .dockerignore patterns in order (later ! patterns re-include)"""
+    ignored = False
+    parents = [rel_path]
+    while '/' in parents[-1]:
+        parents.append(parents[-1].rsplit('/', 1)[0])
+    for pattern in patterns:
+        negate = pattern.startswith('!')
+        pattern = os.path.normpath(pattern.lstrip('!').lstrip('/')).replace(os.sep, '/')
+        if any(fnmatch.fnmatch(p, pattern) or fnmatch.fnmatch(p, pattern.replace('**/', '')) for p in parents):
+            ignored = not negate
+    return ignored
+
+
+def discover_targets(repo_dir: str) -> List[Dict]:
+    """Every Dockerfile in the repository, with the build context it uses and its COPY/ADD sources"""
+    targets = []
+    for root, dirs, files in os.walk(repo_dir):
+        dirs[:] = sorted(d for d in dirs if d not in SKIP_DIRS)
+        for filename in sorted(files):
+            if not is_dockerfile(filename):
+                continue
+            context = os.path.relpath(root, repo_dir).replace(os.sep, '/')
+            dockerfile = filename if context == '.' else f"{context}/{filename}"
+            suffix = ''
+            if filename.startswith('Dockerfile.'):
+                suffix = filename[len('Dockerfile.'):]
+            elif filename.endswith('.Dockerfile'):
+                suffix = filename[:-len('.Dockerfile')]
+            name = '-'.join(part for part in [context.replace('/', '-') if context != '.' else '', suffix] if part)
+            targets.append({
+                'name': name.lower(),
+                'dockerfile': dockerfile,
+                'context': context,
+                'sources': parse_copy_sources(os.path.join(root, filename)),
+                'dockerignore': read_dockerignore(root)
+            })
+    return targets
+
+
+def changed_files(git: GitRunner, base_commit: Optional[str]) -> Optional[List[str]]:
+    """Files changed between base_commit and HEAD, or None when that cannot be known.
+
+    git runs in the (shallow) clone being built; base_commit is fetched from
+    origin first when the clone does not have it.
+    """
+    if not base_commit or base_commit == 'unknown':
+        return None
+    try:
+        if git.run('cat-file', '-e', f'{base_commit}^{{commit}}', check=False).returncode != 0:
+            git.run('fetch', '--depth', '1', 'origin', base_commit)
+        result = git.run('diff', '--name-only', base_commit, 'HEAD')
+    except subprocess.CalledProcessError:
+        return None
+    return [line for line in result.stdout.splitlines() if line]
+
+
+def is_affected(target: Dict, changed: Optional[List[str]]) -> Tuple[bool, str]:
+    """Whether a change set can alter the image built from target, with the reason"""
+    if changed is None:
+        return True, 'changes since the last successful build are unknown'
+    context = target['context']
+    for path in changed:
+        if path == target['dockerfile']:
+            return True, f'{path} changed'
+        if context != '.' and not path.startswith(context + '/'):
+            continue
+        rel_path = path if context == '.' else path[len(context) + 1:]
+        if rel_path == '.dockerignore':
+            return True, f'{path} changed'
+        if is_ignored(rel_path, target['dockerignore']):
+            continue
+        for source in target['sources']:
+            if source in ('.', '*') or rel_path == source or rel_path.startswith(source + '/') \
+                    or fnmatch.fnmatch(rel_path, source):
+                return True, f'{path} is copied by {target["dockerfile"]}'
+    return False, 'no changes in its build inputs'
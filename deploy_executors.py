@@ -0,0 +1,372 @@
+"""Executors for the external calls of a deploy: live, recorded to a trace, or replayed from one.
+
+run_deployment sends every command, GitHub API call and host-dependent step
+through one executor per job:
+
+- run(args, ...)            a drop-in for subprocess.run
+- request(method, url, ...) a drop-in for requests.request
+- call(name, fn, ...)       an in-process step whose outcome depends on the
+                            host (base image wait, artifact store, build agents)
+
+A trace is JSON lines: a header (the redacted payload, the workspace file
+names and the version history the deploy started from), one event per call
+with its arguments, output and timing, and a footer. Secrets are replaced by
+<redacted>. The job's temp dirs, the workspace path and the new version id
+become <tmpN>, <workspace> and <version>, so a replay can substitute its own.
+"""
+import json
+import os
+import re
+import subprocess
+import threading
+import time
+from collections import deque
+from typing import Callable, Dict, List, Optional
+
+import requests
+
+from build_targets import is_dockerfile
+
+TRACE_VERSION = 1
+REDACTED = '<redacted>'
+
+# Dockerfiles larger than this are not copied into a trace
+MAX_CAPTURED_FILE = 256 * 1024
+
+
+class ReplayMismatch(Exception):
+    """The pipeline made a call the trace has no (unused) event for"""
+
+
+def command_shape(args: List[str]) -> List[str]:
+    """Program and subcommand, skipping git's -c key=value options: ['git', 'push']"""
+    program = os.path.basename(args[0]) if args else ''
+    rest = list(args[1:])
+    while len(rest) >= 2 and rest[0] == '-c':
+        rest = rest[2:]
+    return [program] + rest[:1]
+
+
+def capture_dockerfiles(directory: str) -> Dict[str, str]:
+    """Dockerfiles and .dockerignore files under directory, which is what the pipeline reads back from a clone"""
+    files = {}
+    for root, dirs, filenames in os.walk(directory):
+        dirs[:] = [d for d in dirs if d != '.git']
+        for filename in filenames:
+            path = os.path.join(root, filename)
+            if (is_dockerfile(filename) or filename == '.dockerignore') and os.path.getsize(path) <= MAX_CAPTURED_FILE:
+                with open(path, 'r', encoding='utf-8', errors='replace') as f:
+                    files[os.path.relpath(path, directory).replace(os.sep, '/')] = f.read()
+    return files
+
+
+class LiveExecutor:
+    """Runs everything for real; commands go through the job so a cancel kills them"""
+
+    def __init__(self, job):
+        self.job = job
+
+    def run(self, args: List[str], **kwargs) -> subprocess.CompletedProcess:
+        return self.job.run(args, **kwargs)
+
+    def request(self, method: str, url: str, **kwargs) -> requests.Response:
+        self.job.check()
+        return requests.request(method, url, **kwargs)
+
+    def call(self, name: str, fn: Callable, *args, **kwargs):
+        return fn(*args, **kwargs)
+
+    def close(self, version_status: Optional[str] = None):
+        pass
+
+
+class TraceNormalizer:
+    """Swaps secrets and job-specific paths/ids for placeholders, and back"""
+
+    def __init__(self, job, workspace: str, secrets: List[str]):
+        self.job = job
+        self.workspace = workspace
+        # Very short values would blank out unrelated text
+        self.secrets = sorted({s for s in secrets if s and len(s) >= 4}, key=len, reverse=True)
+
+    def placeholders(self) -> List:
+        pairs = [(path, f'<tmp{i}>') for i, path in enumerate(self.job.temp_dirs)]
+        pairs.append((self.workspace, '<workspace>'))
+        if self.job.version_id:
+            pairs.append((self.job.version_id, '<version>'))
+        return sorted(pairs, key=lambda pair: len(pair[0]), reverse=True)
+
+    def normalize(self, value):
+        if isinstance(value, str):
+            for secret in self.secrets:
+                value = value.replace(secret, REDACTED)
+            for real, placeholder in self.placeholders():
+                value = value.replace(real, placeholder)
+            return value
+        if isinstance(value, bytes):
+            return self.normalize(value.decode('utf-8', errors='replace'))
+        if isinstance(value, (list, tuple)):
+            return [self.normalize(item) for item in value]
+        if isinstance(value, dict):
+            return {self.normalize(key): self.normalize(item) for key, item in value.items()}
+        return value
+
+    def denormalize(self, value):
+        if isinstance(value, str):
+            for real, placeholder in self.placeholders():
+                value = value.replace(placeholder, real)
+            return value
+        if isinstance(value, list):
+            return [self.denormalize(item) for item in value]
+        if isinstance(value, dict):
+            return {self.denormalize(key): self.denormalize(item) for key, item in value.items()}
+        return value
+
+
+class RecordingExecutor(LiveExecutor):
+    """Runs everything for real and appends each call, with its output and timing, to a trace file"""
+
+    def __init__(self, job, path: str, payload: Dict, secrets: List[str], context: Optional[Dict] = None):
+        super().__init__(job)
+        self.path = path
+        self.normalizer = TraceNormalizer(job, os.getcwd(), secrets)
+        self.lock = threading.Lock()
+        self.local = threading.local()
+        self.seq = 0
+        self.started = time.monotonic()
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self.file = open(path, 'w', encoding='utf-8')
+        self._write(dict({
+            'type': 'header',
+            'version': TRACE_VERSION,
+            'job_id': job.job_id,
+            'project': job.project,
+            'recorded_at': time.time(),
+            'payload': self.normalizer.normalize(payload)
+        }, **self.normalizer.normalize(context or {})))
+
+    def _write(self, event: Dict):
+        with self.lock:
+            if event['type'] not in ('header', 'footer'):
+                self.seq += 1
+                event['seq'] = self.seq
+            # default=str: a call() result that is not plain JSON is kept as its repr
+            self.file.write(json.dumps(event, default=str) + '\n')
+            self.file.flush()
+
+    def _event(self, kind: str, started: float, fields: Dict) -> Dict:
+        return dict({
+            'type': kind,
+            'thread': threading.current_thread().name,
+            'start': round(started - self.started, 6),
+            'duration': round(time.monotonic() - started, 6)
+        }, **self.normalizer.normalize(fields))
+
+    def _nested(self) -> bool:
+        # Calls made inside a recorded call() replay as part of it
+        return getattr(self.local, 'depth', 0) > 0
+
+    def run(self, args: List[str], **kwargs) -> subprocess.CompletedProcess:
+        if self._nested():
+            return super().run(args, **kwargs)
+        started = time.monotonic()
+        fields = {'args': list(args), 'input': kwargs.get('input')}
+        try:
+            result = super().run(args, **kwargs)
+        except subprocess.CalledProcessError as e:
+            fields.update(returncode=e.returncode, stdout=e.stdout, stderr=e.stderr)
+            self._write(self._event('command', started, fields))
+            raise
+        except subprocess.TimeoutExpired as e:
+            fields.update(error='timeout', timeout=e.timeout)
+            self._write(self._event('command', started, fields))
+            raise
+        except OSError as e:
+            fields.update(error='oserror', message=str(e))
+            self._write(self._event('command', started, fields))
+            raise
+        fields.update(returncode=result.returncode, stdout=result.stdout, stderr=result.stderr)
+        if command_shape(args) == ['git', 'clone'] and result.returncode == 0 and os.path.isdir(args[-1]):
+            fields['files'] = capture_dockerfiles(args[-1])
+        self._write(self._event('command', started, fields))
+        return result
+
+    def request(self, method: str, url: str, **kwargs) -> requests.Response:
+        if self._nested():
+            return super().request(method, url, **kwargs)
+        started = time.monotonic()
+        fields = {'method': method.upper(), 'url': url, 'json': kwargs.get('json')}
+        try:
+            response = super().request(method, url, **kwargs)
+        except requests.exceptions.RequestException as e:
+            fields.update(error=type(e).__name__, message=str(e))
+            self._write(self._event('http', started, fields))
+            raise
+        fields.update(status=response.status_code, headers=dict(response.headers), body=response.text)
+        self._write(self._event('http', started, fields))
+        return response
+
+    def call(self, name: str, fn: Callable, *args, **kwargs):
+        started = time.monotonic()
+        fields = {'name': name}
+        self.local.depth = getattr(self.local, 'depth', 0) + 1
+        try:
+            result = fn(*args, **kwargs)
+        except Exception as e:
+            fields.update(error=type(e).__name__, message=str(e))
+            raise
+        else:
+            fields['result'] = result
+            return result
+        finally:
+            self.local.depth -= 1
+            if not self._nested():
+                self._write(self._event('call', started, fields))
+
+    def close(self, version_status: Optional[str] = None):
+        self._write({'type': 'footer', 'status': self.job.status, 'version_status': version_status,
+                     'duration': round(time.monotonic() - self.started, 6), 'events': self.seq})
+        self.file.close()
+
+
+def load_trace(path: str) -> Dict:
+    """{'header': ..., 'events': [...], 'footer': ... or None}"""
+    trace = {'header': None, 'events': [], 'footer': None}
+    with open(path, 'r', encoding='utf-8') as f:
+        for line in f:
+            if not line.strip():
+                continue
+            event = json.loads(line)
+            if event['type'] in ('header', 'footer'):
+                trace[event['type']] = event
+            else:
+                trace['events'].append(event)
+    if trace['header'] is None or trace['header'].get('version') != TRACE_VERSION:
+        raise ValueError(f"{path} is not a version {TRACE_VERSION} deploy trace")
+    return trace
+
+
+class ReplayExecutor:
+    """Answers every call from a trace instead of running it.
+
+    A call is matched to the first unused event with the same normalized
+    arguments. Failing that, it goes to the first unused event of the same
+    shape (git push, docker build, GET /repos/...), since some arguments
+    hold a timestamp. The caller then waits the recorded duration divided
+    by speed; speed 0 answers at once, which measures the orchestrator's
+    own overhead. A wait ends early when the job is cancelled.
+    """
+
+    def __init__(self, job, trace: Dict, speed: float = 1.0, secrets: Optional[List[str]] = None):
+        self.job = job
+        self.speed = speed
+        self.normalizer = TraceNormalizer(job, os.getcwd(), secrets or [])
+        self.lock = threading.Lock()
+        self.events = trace['events']
+        self.used = set()
+        self.exact: Dict[str, deque] = {}
+        self.loose: Dict[str, deque] = {}
+        for index, event in enumerate(self.events):
+            self.exact.setdefault(self._exact_key(event), deque()).append(index)
+            self.loose.setdefault(self._loose_key(event), deque()).append(index)
+        self.matched = {'exact': 0, 'loose': 0}
+
+    @staticmethod
+    def _exact_key(event: Dict) -> str:
+        if event['type'] == 'command':
+            return json.dumps(['command', event['args'], event.get('input')])
+        if event['type'] == 'http':
+            return json.dumps(['http', event['method'], event['url'], event.get('json')])
+        return json.dumps(['call', event['name']])
+
+    @staticmethod
+    def _loose_key(event: Dict) -> str:
+        if event['type'] == 'command':
+            return json.dumps(['command', command_shape(event['args'])])
+        if event['type'] == 'http':
+            # Path without the query or the last segment (repository names, ids)
+            path = re.sub(r'^https?://[^/]+', '', event['url']).split('?')[0]
+            return json.dumps(['http', event['method'], path.rsplit('/', 1)[0]])
+        return json.dumps(['call', event['name']])
+
+    def _take(self, probe: Dict) -> Dict:
+        with self.lock:
+            for kind, index_by in (('exact', self.exact), ('loose', self.loose)):
+                key = self._exact_key(probe) if kind == 'exact' else self._loose_key(probe)
+                queue = index_by.get(key)
+                while queue and queue[0] in self.used:
+                    queue.popleft()
+                if queue:
+                    index = queue.popleft()
+                    self.used.add(index)
+                    self.matched[kind] += 1
+                    return self.events[index]
+        raise ReplayMismatch(f"No recorded {probe['type']} left for {self._exact_key(probe)}")
+
+    def _wait(self, event: Dict):
+        self.job.check()
+        if self.speed > 0:
+            self.job.cancel_event.wait(event['duration'] / self.speed)
+        self.job.check()
+
+    def run(self, args: List[str], *, input=None, capture_output: bool = False, text: bool = False,
+            check: bool = False, timeout: Optional[float] = None, cwd: Optional[str] = None,
+            env: Optional[Dict[str, str]] = None) -> subprocess.CompletedProcess:
+        normalize = self.normalizer.normalize
+        event = self._take({'type': 'command', 'args': normalize(list(args)), 'input': normalize(input)})
+        self._wait(event)
+        if event.get('error') == 'timeout':
+            raise subprocess.TimeoutExpired(args, event.get('timeout') or timeout)
+        if event.get('error') == 'oserror':
+            raise FileNotFoundError(event['message'])
+        for relpath, content in event.get('files', {}).items():
+            path = os.path.join(args[-1], *relpath.split('/'))
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            with open(path, 'w', encoding='utf-8') as f:
+                f.write(content)
+
+        def output(value):
+            if not capture_output or value is None:
+                return None
+            value = self.normalizer.denormalize(value)
+            return value if text else value.encode('utf-8')
+        stdout, stderr = output(event.get('stdout')), output(event.get('stderr'))
+        if check and event['returncode']:
+            raise subprocess.CalledProcessError(event['returncode'], args, stdout, stderr)
+        return subprocess.CompletedProcess(args, event['returncode'], stdout, stderr)
+
+    def request(self, method: str, url: str, **kwargs) -> requests.Response:
+        normalize = self.normalizer.normalize
+        event = self._take({'type': 'http', 'method': method.upper(), 'url': normalize(url),
+                            'json': normalize(kwargs.get('json'))})
+        self._wait(event)
+        if event.get('error'):
+            error = getattr(requests.exceptions, event['error'], requests.exceptions.RequestException)
+            raise error(event['message'])
+        response = requests.Response()
+        response.status_code = event['status']
+        response.headers = requests.structures.CaseInsensitiveDict(event['headers'])
+        response._content = self.normalizer.denormalize(event['body']).encode('utf-8')
+        response.encoding = 'utf-8'
+        response.url = url
+        return response
+
+    def call(self, name: str, fn: Callable, *args, **kwargs):
+        event = self._take({'type': 'call', 'name': name})
+        self._wait(event)
+        if event.get('error'):
+            raise RuntimeError(event['message'])
+        return self.normalizer.denormalize(event.get('result'))
+
+    def close(self, version_status: Optional[str] = None):
+        pass
+
+    def report(self) -> Dict:
+        unused = [event for index, event in enumerate(self.events) if index not in self.used]
+        return {
+            'events': len(self.events),
+            'matched_exact': self.matched['exact'],
+            'matched_loose': self.matched['loose'],
+            'unused': [command_shape(e['args']) if e['type'] == 'command' else e.get('url', e.get('name'))
+                       for e in unused]
+        }
@@ -0,0 +1,346 @@
+import os
+import shutil
+import signal
+import socket
+import subprocess
+import tempfile
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from contextlib import contextmanager
+from datetime import datetime
+from typing import Callable, Dict, List, Optional
+
+from shared_state import SharedState
+
+
+class JobAborted(Exception):
+    """Raised inside a deploy job once it has been cancelled or a stage ran past its timeout"""
+
+    def __init__(self, status: str, message: str):
+        super().__init__(message)
+        self.status = status
+
+
+def terminate_process_tree(process: subprocess.Popen, grace: float = 10.0):
+    """SIGTERM the process group (docker then cancels the build on the daemon), SIGKILL what is left after grace"""
+    if os.name == 'nt':
+        subprocess.run(['taskkill', '/T', '/F', '/PID', str(process.pid)], capture_output=True)
+        return
+    for sig in (signal.SIGTERM, signal.SIGKILL):
+        try:
+            os.killpg(process.pid, sig)
+        except (ProcessLookupError, PermissionError):
+            return
+        if sig == signal.SIGTERM:
+            try:
+                process.wait(grace)
+            except subprocess.TimeoutExpired:
+                pass
+
+
+class DeployJob:
+    """One running deploy: its child processes, temp dirs and current stage deadline.
+
+    Every command is started in its own process group through run(), so a
+    cancel or a stage timeout kills the whole tree (docker CLI, credential
+    helpers, git remote helpers) rather than just the direct child.
+    """
+
+    def __init__(self, job_id: str, project: str, kill_grace: float = 10.0,
+                 on_change: Optional[Callable[['DeployJob'], None]] = None):
+        self.job_id = job_id
+        self.project = project
+        self.kill_grace = kill_grace
+        self.on_change = on_change
+        self.version_id = None
+        self.status = 'running'
+        self.message = ''
+        self.stage = None
+        self.stage_timeout = None
+        self.deadline = None
+        self.queue_position = None
+        self.hold_reasons: List[str] = []
+        self.started_at = datetime.now().isoformat()
+        self.finished_at = None
+        self.cancel_event = threading.Event()
+        self.lock = threading.Lock()
+        self.processes = set()
+        self.abort_hooks: List[Callable[[], None]] = []
+        self.temp_dirs: List[str] = []
+        self.timer = None
+
+    def begin_stage(self, name: str, timeout: Optional[float] = None):
+        """Enter the next pipeline stage; the job is aborted as timed_out if it is still there after timeout"""
+        self.check()
+        with self.lock:
+            if self.timer:
+                self.timer.cancel()
+            self.stage = name
+            self.stage_timeout = timeout
+            self.deadline = time.monotonic() + timeout if timeout else None
+            if timeout:
+                self.timer = threading.Timer(timeout, self._stage_expired, args=(name,))
+                self.timer.daemon = True
+                self.timer.start()
+        self._changed()
+
+    def set_hold(self, queue_position: Optional[int], reasons: List[str]):
+        """Where the job waits for build capacity and why (None and [] once admitted)"""
+        self.queue_position = queue_position
+        self.hold_reasons = reasons
+        self._changed()
+
+    def attach_version(self, version_id: str):
+        self.version_id = version_id
+        self._changed()
+
+    def _changed(self):
+        if self.on_change:
+            self.on_change(self)
+
+    def _stage_expired(self, name: str):
+        if self.stage == name:
+            self.abort('timed_out', f"Stage {name} timed out after {self.stage_timeout:g}s")
+
+    def remaining(self, default: float) -> float:
+        """Seconds left in the current stage, capped at default"""
+        if self.deadline is None:
+            return default
+        return max(0.0, min(default, self.deadline - time.monotonic()))
+
+    def check(self):
+        """Raise JobAborted if the job was cancelled or timed out"""
+        if self.cancel_event.is_set():
+            raise JobAborted(self.status, self.message)
+
+    def abort(self, status: str, message: str) -> bool:
+        """Stop the job and kill its process trees; returns False if it already stopped"""
+        with self.lock:
+            if self.cancel_event.is_set() or self.finished_at:
+                return False
+            self.status = status
+            self.message = message
+            self.cancel_event.set()
+            processes = list(self.processes)
+            hooks = list(self.abort_hooks)
+        self._terminate(processes)
+        for hook in hooks:
+            self._call_hook(hook)
+        self._changed()
+        return True
+
+    @contextmanager
+    def abort_hook(self, hook: Callable[[], None]):
+        """Call hook if the job is aborted while the block runs (at once if it already was).
+
+        For waits that are not a child process: a hook closes the stream or
+        wakes the wait, so a cancel or timeout does not sit behind it.
+        """
+        with self.lock:
+            self.abort_hooks.append(hook)
+            aborted = self.cancel_event.is_set()
+        if aborted:
+            self._call_hook(hook)
+        try:
+            yield
+        finally:
+            with self.lock:
+                self.abort_hooks.remove(hook)
+
+    def _call_hook(self, hook: Callable[[], None]):
+        try:
+            hook()
+        except Exception as e:
+            print(f"⚠️ Abort hook of job {self.job_id} failed: {e}")
+
+    def kill_processes(self):
+        """Kill the commands running right now without stopping the job (a failed stage stopping its siblings)"""
+        with self.lock:
+            processes = list(self.processes)
+        self._terminate(processes)
+
+    def _terminate(self, processes: List[subprocess.Popen]):
+        for process in processes:
+            threading.Thread(target=terminate_process_tree, args=(process, self.kill_grace), daemon=True).start()
+
+    def run(self, args: List[str], *, input=None, capture_output: bool = False, text: bool = False,
+            check: bool = False, timeout: Optional[float] = None, cwd: Optional[str] = None,
+            env: Optional[Dict[str, str]] = None) -> subprocess.CompletedProcess:
+        """Drop-in for subprocess.run whose process group dies with the job"""
+        self.check()
+        pipe = subprocess.PIPE if capture_output else None
+        if os.name == 'nt':
+            group = {'creationflags': subprocess.CREATE_NEW_PROCESS_GROUP}
+        else:
+            group = {'start_new_session': True}
+        process = subprocess.Popen(args, stdin=subprocess.PIPE if input is not None else None, stdout=pipe,
+                                   stderr=pipe, text=text, cwd=cwd, env=env, **group)
+        with self.lock:
+            self.processes.add(process)
+            aborted = self.cancel_event.is_set()
+        try:
+            if aborted:
+                terminate_process_tree(process, self.kill_grace)
+            try:
+                stdout, stderr = process.communicate(input, timeout=timeout)
+            except subprocess.TimeoutExpired:
+                terminate_process_tree(process, self.kill_grace)
+                process.communicate()
+                raise
+        finally:
+            with self.lock:
+                self.processes.discard(process)
+        self.check()
+        if check and process.returncode:
+            raise subprocess.CalledProcessError(process.returncode, args, stdout, stderr)
+        return subprocess.CompletedProcess(args, process.returncode, stdout, stderr)
+
+    def mkdtemp(self) -> str:
+        """Temp dir that is removed when the job finishes, however it ends"""
+        path = tempfile.mkdtemp()
+        self.temp_dirs.append(path)
+        return path
+
+    def finish(self):
+        """Release the job's timer and temp dirs; the status stays cancelled/timed_out if it was aborted"""
+        with self.lock:
+            if self.timer:
+                self.timer.cancel()
+            if self.status == 'running':
+                self.status = 'finished'
+            self.finished_at = datetime.now().isoformat()
+        for path in self.temp_dirs:
+            shutil.rmtree(path, ignore_errors=True)
+        self._changed()
+
+    def to_dict(self) -> Dict:
+        return {
+            'job_id': self.job_id,
+            'project': self.project,
+            'version_id': self.version_id,
+            'status': self.status,
+            'message': self.message,
+            'stage': self.stage,
+            'stage_timeout': self.stage_timeout,
+            'queue_position': self.queue_position,
+            'hold_reasons': self.hold_reasons,
+            'started_at': self.started_at,
+            'finished_at': self.finished_at,
+            'processes': len(self.processes)
+        }
+
+
+def pid_alive(pid: int) -> bool:
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+def worker_id() -> str:
+    """host:pid of this worker process; read on use, since a pre-forking server imports the app before forking"""
+    return f"{socket.gethostname()}:{os.getpid()}"
+
+
+def worker_dead(worker: str) -> bool:
+    """Whether a worker_id() belongs to another process on this host that has exited"""
+    if os.name == 'nt':
+        # os.kill(pid, 0) would terminate the process on Windows
+        return False
+    worker_host, _, pid = worker.rpartition(':')
+    return worker_host == socket.gethostname() and int(pid) != os.getpid() and not pid_alive(int(pid))
+
+
+class JobRegistry:
+    """Deploy jobs by id.
+
+    A job runs in the worker process that created it. With a SharedState the
+    job table is shared by all workers: any of them lists every job and
+    accepts a cancel, which the owning worker's watcher thread then applies.
+    """
+
+    def __init__(self, keep_finished: int = 100, kill_grace: float = 10.0, state: Optional[SharedState] = None,
+                 poll_interval: float = 1.0):
+        self.keep_finished = keep_finished
+        self.kill_grace = kill_grace
+        self.state = state
+        self.poll_interval = poll_interval
+        self.lock = threading.Lock()
+        self.jobs: 'OrderedDict[str, DeployJob]' = OrderedDict()
+        self.watcher_pid = None
+        if state:
+            self._ensure_watcher()
+
+    @property
+    def worker(self) -> str:
+        return worker_id()
+
+    def create(self, project: str) -> DeployJob:
+        job = DeployJob(f"job_{datetime.now().strftime('%Y%m%d_%H%M%S')}_{uuid.uuid4().hex[:6]}", project,
+                        kill_grace=self.kill_grace, on_change=self._persist if self.state else None)
+        with self.lock:
+            self.jobs[job.job_id] = job
+            finished = [job_id for job_id, j in self.jobs.items() if j.finished_at]
+            for job_id in finished[:max(0, len(finished) - self.keep_finished)]:
+                del self.jobs[job_id]
+        if self.state:
+            self._persist(job)
+            self._ensure_watcher()
+        return job
+
+    def _persist(self, job: DeployJob):
+        self.state.save_job(job.to_dict(), self.worker)
+
+    def _ensure_watcher(self):
+        with self.lock:
+            if self.watcher_pid == os.getpid():
+                return
+            self.watcher_pid = os.getpid()
+        threading.Thread(target=self._watch, daemon=True, name='job-watcher').start()
+
+    def _watch(self):
+        """Apply cancels sent to other workers and retire jobs of workers that died"""
+        while True:
+            try:
+                for job_id in self.state.cancel_requests(self.worker):
+                    self.cancel(job_id)
+                self._mark_lost_jobs()
+            except Exception as e:
+                print(f"⚠️ Job watcher: {e}")
+            time.sleep(self.poll_interval)
+
+    def _mark_lost_jobs(self):
+        for job_id, worker in self.state.running_jobs():
+            if worker_dead(worker):
+                self.state.mark_job(job_id, 'lost', f'Worker {worker} exited while the job was running')
+
+    def get(self, job_id: str) -> Optional[DeployJob]:
+        """A job running (or recently run) in this process"""
+        with self.lock:
+            return self.jobs.get(job_id)
+
+    def status(self, job_id: str) -> Optional[Dict]:
+        job = self.get(job_id)
+        if job is not None:
+            return job.to_dict()
+        return self.state.get_job(job_id) if self.state else None
+
+    def cancel(self, job_id: str) -> Optional[bool]:
+        """Cancel a job; None if unknown, False if it had already stopped"""
+        job = self.get(job_id)
+        if job is not None:
+            return job.abort('cancelled', 'Cancelled by user')
+        return self.state.request_cancel(job_id) if self.state else None
+
+    def list_jobs(self) -> List[Dict]:
+        """Newest first"""
+        if self.state:
+            return self.state.list_jobs(self.keep_finished)
+        with self.lock:
+            jobs = list(self.jobs.values())
+        return [job.to_dict() for job in reversed(jobs)]
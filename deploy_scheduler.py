@@ -0,0 +1,171 @@
+import json
+import os
+import threading
+import time
+from typing import Callable, Dict, List, Optional
+
+from deploy_jobs import worker_dead, worker_id
+from shared_state import SharedState, open_state
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS webhook_deploys (
+    repo TEXT PRIMARY KEY,
+    pending_commit TEXT,
+    pending_params TEXT,
+    first_pending_at REAL,
+    deadline REAL,
+    running_commit TEXT,
+    running_worker TEXT
+);
+CREATE TABLE IF NOT EXISTS webhook_counters (
+    name TEXT PRIMARY KEY,
+    value INTEGER NOT NULL
+);
+"""
+
+COUNTERS = ('received', 'coalesced', 'dropped', 'started')
+
+
+class DeployScheduler:
+    """Debounces push-triggered deploys and coalesces them per repository.
+
+    Each push replaces the repository's pending deploy, so only the newest
+    commit is built. A pending deploy starts once no push has arrived for
+    `debounce` seconds (or `max_wait` after the first one) and no deploy of
+    the same repository is running. A push for the commit that is already
+    being built is dropped.
+
+    Pending and running deploys live in the shared SQLite state, so these
+    rules hold across worker processes: whichever worker's loop finds a
+    deploy due runs it. params are stored with it and must be JSON; the
+    runner is called as runner(repo, commit, params).
+    """
+
+    def __init__(self, runner: Callable[[str, str, Dict], None], debounce: float = 10.0, max_wait: float = 60.0,
+                 log: Callable[[str], None] = print, state: Optional[SharedState] = None,
+                 poll_interval: float = 1.0):
+        self.runner = runner
+        self.debounce = debounce
+        self.max_wait = max_wait
+        self.log = log
+        self.state = state or open_state()
+        self.state.connection().executescript(SCHEMA)
+        self.poll_interval = poll_interval
+        # Wakes this process's loop early on a local push or finish; other workers' are seen at the next poll
+        self.condition = threading.Condition()
+        self.thread = None
+        self.thread_pid = None
+
+    def start(self):
+        """Start the scheduling loop, once per process (a forked worker does not inherit the thread)"""
+        with self.condition:
+            if self.thread_pid == os.getpid():
+                return
+            self.thread_pid = os.getpid()
+            self.thread = threading.Thread(target=self._run, daemon=True, name='deploy-scheduler')
+            self.thread.start()
+
+    def _count(self, conn, name: str):
+        conn.execute('INSERT INTO webhook_counters (name, value) VALUES (?, 1) '
+                     'ON CONFLICT(name) DO UPDATE SET value = value + 1', (name,))
+
+    @staticmethod
+    def _running(row) -> Optional[str]:
+        """The commit being built, unless the worker building it has died"""
+        running_commit, running_worker = row
+        if running_commit is None or worker_dead(running_worker):
+            return None
+        return running_commit
+
+    def submit(self, repo: str, commit: str, params: Optional[Dict] = None) -> str:
+        """Queue a deploy of commit; returns 'queued', 'coalesced' or 'dropped'"""
+        self.start()
+        now = time.time()
+        with self.state.transaction() as conn:
+            self._count(conn, 'received')
+            conn.execute('INSERT OR IGNORE INTO webhook_deploys (repo) VALUES (?)', (repo,))
+            pending, first_pending_at, running_commit, running_worker = conn.execute(
+                'SELECT pending_commit, first_pending_at, running_commit, running_worker FROM webhook_deploys '
+                'WHERE repo = ?', (repo,)).fetchone()
+            if commit and commit == self._running((running_commit, running_worker)):
+                self._count(conn, 'dropped')
+                return 'dropped'
+
+            outcome = 'queued'
+            if pending is not None:
+                self._count(conn, 'coalesced')
+                outcome = 'coalesced'
+            else:
+                first_pending_at = now
+            conn.execute('UPDATE webhook_deploys SET pending_commit = ?, pending_params = ?, first_pending_at = ?, '
+                         'deadline = ? WHERE repo = ?',
+                         (commit, json.dumps(params or {}), first_pending_at,
+                          min(now + self.debounce, first_pending_at + self.max_wait), repo))
+        with self.condition:
+            self.condition.notify()
+        return outcome
+
+    def status(self) -> Dict:
+        conn = self.state.connection()
+        counters = dict.fromkeys(COUNTERS, 0)
+        counters.update(conn.execute('SELECT name, value FROM webhook_counters').fetchall())
+        repos = {}
+        for repo, pending, running, worker in conn.execute(
+                'SELECT repo, pending_commit, running_commit, running_worker FROM webhook_deploys'):
+            running = self._running((running, worker))
+            repos[repo] = {'pending_commit': pending, 'running_commit': running,
+                           'running_worker': worker if running else None}
+        return {'counters': counters, 'repos': repos}
+
+    def _claim_due(self) -> List[Dict]:
+        """Mark every due deploy as running in this worker; returns them"""
+        now = time.time()
+        claimed = []
+        with self.state.transaction() as conn:
+            rows = conn.execute('SELECT repo, pending_commit, pending_params, running_commit, running_worker '
+                                'FROM webhook_deploys WHERE pending_commit IS NOT NULL AND deadline <= ?',
+                                (now,)).fetchall()
+            for repo, commit, params, running_commit, running_worker in rows:
+                if self._running((running_commit, running_worker)) is not None:
+                    continue
+                conn.execute('UPDATE webhook_deploys SET pending_commit = NULL, pending_params = NULL, '
+                             'first_pending_at = NULL, deadline = NULL, running_commit = ?, running_worker = ? '
+                             'WHERE repo = ?', (commit, worker_id(), repo))
+                self._count(conn, 'started')
+                claimed.append({'repo': repo, 'commit': commit, 'params': json.loads(params)})
+        return claimed
+
+    def _next_wakeup(self) -> float:
+        # A deploy waiting behind a running one is picked up when that one finishes (or at the next poll)
+        deadline = self.state.connection().execute(
+            'SELECT MIN(deadline) FROM webhook_deploys WHERE pending_commit IS NOT NULL AND running_commit IS NULL'
+        ).fetchone()[0]
+        if deadline is None:
+            return self.poll_interval
+        return max(0.0, min(self.poll_interval, deadline - time.time()))
+
+    def _run(self):
+        while True:
+            try:
+                for job in self._claim_due():
+                    threading.Thread(target=self._execute, args=(job,), daemon=True).start()
+                wakeup = self._next_wakeup()
+            except Exception as e:
+                self.log(f"⚠️ Deploy scheduler: {e}")
+                wakeup = self.poll_interval
+            with self.condition:
+                self.condition.wait(wakeup)
+
+    def _execute(self, job: Dict):
+        repo = job['repo']
+        try:
+            self.log(f"🪝 Starting webhook deploy of {repo} at {job['commit'][:8] if job['commit'] else 'HEAD'}")
+            self.runner(repo, job['commit'], job['params'])
+        except Exception as e:
+            self.log(f"❌ Webhook deploy of {repo} failed: {e}")
+        finally:
+            self.state.connection().execute(
+                'UPDATE webhook_deploys SET running_commit = NULL, running_worker = NULL '
+                'WHERE repo = ? AND running_worker = ?', (repo, worker_id()))
+            with self.condition:
+                self.condition.notify()
@@ -0,0 +1,107 @@
+import subprocess
+import threading
+from typing import Callable, Dict, Optional
+
+
+class GitRunner:
+    """Single entry point for the git commands of one deploy job.
+
+    Read-only metadata is gathered with as few processes as possible and
+    memoized until a command that changes the repository invalidates it.
+    """
+
+    def __init__(self, cwd: Optional[str] = None, env: Optional[Dict[str, str]] = None, git_cmd: str = 'git',
+                 runner: Callable[..., subprocess.CompletedProcess] = subprocess.run):
+        self.cwd = cwd
+        self.env = env
+        self.git_cmd = git_cmd
+        self.runner = runner
+        self.spawn_count = 0
+        self.lock = threading.Lock()
+        self._head_info: Optional[Dict] = None
+        self._remotes: Optional[Dict[str, str]] = None
+
+    def run(self, *args: str, check: bool = True, timeout: Optional[float] = None,
+            config: Optional[Dict[str, str]] = None) -> subprocess.CompletedProcess:
+        """Run one git command; config entries are passed as -c key=value for this call only"""
+        command = [self.git_cmd]
+        for key, value in (config or {}).items():
+            command += ['-c', f'{key}={value}']
+        command += list(args)
+        with self.lock:
+            self.spawn_count += 1
+        return self.runner(command, cwd=self.cwd, env=self.env, capture_output=True,
+                           text=True, check=check, timeout=timeout)
+
+    def head_info(self) -> Dict:
+        """Commit, branch and working tree changes from a single `git status --porcelain=v2 --branch`"""
+        if self._head_info is None:
+            info = {'commit': None, 'branch': None, 'changes': []}
+            result = self.run('status', '--porcelain=v2', '--branch')
+            for line in result.stdout.splitlines():
+                if line.startswith('# branch.oid '):
+                    oid = line.split(' ', 2)[2]
+                    info['commit'] = None if oid == '(initial)' else oid
+                elif line.startswith('# branch.head '):
+                    head = line.split(' ', 2)[2]
+                    info['branch'] = '' if head == '(detached)' else head
+                elif line and not line.startswith('#'):
+                    info['changes'].append(line)
+            self._head_info = info
+        return self._head_info
+
+    def commit_hash(self) -> Optional[str]:
+        return self.head_info()['commit']
+
+    def current_branch(self) -> Optional[str]:
+        return self.head_info()['branch']
+
+    def has_changes(self) -> bool:
+        return bool(self.head_info()['changes'])
+
+    def remotes(self) -> Dict[str, str]:
+        """Remote name -> URL, read once from the git config"""
+        if self._remotes is None:
+            remotes = {}
+            result = self.run('config', '--get-regexp', r'^remote\..*\.url$', check=False)
+            for line in result.stdout.splitlines():
+                key, _, url = line.partition(' ')
+                remotes[key[len('remote.'):-len('.url')]] = url
+            self._remotes = remotes
+        return self._remotes
+
+    def ls_remote(self, url: str, timeout: Optional[float] = None) -> Dict[str, str]:
+        """Ref name -> commit advertised by the remote (HEAD, refs/heads/*, refs/tags/*)"""
+        result = self.run('ls-remote', url, timeout=timeout)
+        refs = {}
+        for line in result.stdout.splitlines():
+            sha, _, ref = line.partition('\t')
+            if ref:
+                refs[ref] = sha
+        return refs
+
+    def is_ancestor(self, ancestor: str, descendant: str = 'HEAD') -> bool:
+        """True if ancestor is in descendant's history (False also when the commit is not available locally)"""
+        return self.run('merge-base', '--is-ancestor', ancestor, descendant, check=False).returncode == 0
+
+    def set_remote_url(self, name: str, url: str):
+        """Add the remote or point it at url, whichever applies"""
+        if name in self.remotes():
+            self.run('remote', 'set-url', name, url)
+        else:
+            self.run('remote', 'add', name, url)
+        self._remotes[name] = url
+
+    def commit_all(self, message: str):
+        """Stage everything and commit it"""
+        self.run('add', '.')
+        self.run('commit', '-m', message)
+        self.invalidate()
+
+    def invalidate(self):
+        """Forget memoized metadata after the repository changed"""
+        self._head_info = None
+
+    def summary(self) -> str:
+        return f"{self.spawn_count} git process(es)"
+
@@ -0,0 +1,79 @@
+import json
+import subprocess
+from collections import defaultdict
+from typing import Callable, Dict, Optional
+
+# How many of the most changed layers a comparison lists
+TOP_LAYERS = 5
+
+
+def measure_image(image_ref: str, run: Callable = subprocess.run, docker_cmd: str = 'docker') -> Dict:
+    """Uncompressed size, layer count and per-layer sizes of a local image.
+
+    Layers come from `docker history` (oldest first) and keep the instruction
+    that created them, which is what lets two versions be compared layer by
+    layer; steps that add no bytes (ENV, CMD, ...) are left out.
+    """
+    result = run([docker_cmd, 'image', 'inspect', image_ref], check=True, capture_output=True, text=True)
+    inspect = json.loads(result.stdout)[0]
+    result = run([docker_cmd, 'history', '--no-trunc', '--human=false', '--format', '{{json .}}', image_ref],
+                 check=True, capture_output=True, text=True)
+    layers = []
+    for line in reversed(result.stdout.splitlines()):
+        if not line.strip():
+            continue
+        entry = json.loads(line)
+        size = int(entry.get('Size') or 0)
+        if size:
+            layers.append({'created_by': ' '.join(entry.get('CreatedBy', '').split())[:200], 'size': size})
+    return {
+        'size': inspect['Size'],
+        'layer_count': len(inspect.get('RootFS', {}).get('Layers', [])) or len(layers),
+        'layers': layers
+    }
+
+
+def compare_images(previous: Dict, current: Dict, max_growth: float, min_bytes: int = 0) -> Dict:
+    """Size and layer changes from previous to current.
+
+    Layers are matched by the instruction that created them. flagged is set
+    when the image grew by more than max_growth (a fraction of the previous
+    size) and by at least min_bytes, so small images are not flagged for a
+    few kilobytes.
+    """
+    size_delta = current['size'] - previous['size']
+    growth = size_delta / previous['size'] if previous['size'] else None
+
+    # The same instruction can appear twice (two identical COPY lines): match in order
+    unmatched = defaultdict(list)
+    for layer in previous['layers']:
+        unmatched[layer['created_by']].append(layer['size'])
+    changed = []
+    for layer in current['layers']:
+        sizes = unmatched[layer['created_by']]
+        previous_size = sizes.pop(0) if sizes else None
+        if previous_size != layer['size']:
+            changed.append({'created_by': layer['created_by'], 'previous_size': previous_size, 'size': layer['size']})
+    for created_by, sizes in unmatched.items():
+        changed.extend({'created_by': created_by, 'previous_size': size, 'size': None} for size in sizes)
+    changed.sort(key=lambda c: abs((c['size'] or 0) - (c['previous_size'] or 0)), reverse=True)
+
+    return {
+        'previous_size': previous['size'],
+        'size': current['size'],
+        'size_delta': size_delta,
+        'growth': round(growth, 4) if growth is not None else None,
+        'layer_count_delta': current['layer_count'] - previous['layer_count'],
+        'changed_layers': changed[:TOP_LAYERS],
+        'flagged': growth is not None and growth > max_growth and size_delta >= min_bytes
+    }
+
+
+def format_size(size: Optional[int]) -> str:
+    if size is None:
+        return '-'
+    for unit in ('B', 'KB', 'MB'):
+        if abs(size) < 1000:
+            return f"{size:.0f} {unit}" if unit == 'B' else f"{size:.1f} {unit}"
+        size /= 1000
+    return f"{size:.2f} GB"
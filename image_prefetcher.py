@@ -0,0 +1,211 @@
+import os
+import re
+import shlex
+import subprocess
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from typing import Callable, Dict, List, Optional
+
+ARG_PATTERN = re.compile(r'\$\{([A-Za-z_][A-Za-z0-9_]*)(?::-([^}]*))?\}|\$([A-Za-z_][A-Za-z0-9_]*)')
+
+
+def read_instructions(dockerfile_path: str) -> List[List[str]]:
+    """Split a Dockerfile into instructions, joining line continuations and dropping comments"""
+    instructions = []
+    current = ''
+    with open(dockerfile_path, 'r', encoding='utf-8', errors='replace') as f:
+        for raw_line in f:
+            line = raw_line.strip()
+            if not current and (not line or line.startswith('#')):
+                continue
+            if line.endswith('\\'):
+                current += line[:-1] + ' '
+                continue
+            current += line
+            try:
+                parts = shlex.split(current, comments=False)
+            except ValueError:
+                parts = current.split()
+            if parts:
+                instructions.append(parts)
+            current = ''
+    return instructions
+
+
+def substitute_args(value: str, args: Dict[str, str]) -> Optional[str]:
+    """Expand $VAR / ${VAR} / ${VAR:-default}; returns None if a variable has no value"""
+    unresolved = []
+
+    def replace(match):
+        name = match.group(1) or match.group(3)
+        if args.get(name):
+            return args[name]
+        if match.group(2) is not None:
+            return match.group(2)
+        unresolved.append(name)
+        return ''
+
+    result = ARG_PATTERN.sub(replace, value)
+    return None if unresolved else result
+
+
+def parse_base_images(dockerfile_path: str, build_args: Optional[Dict[str, str]] = None) -> List[str]:
+    """Return the external images referenced by FROM lines, in order.
+
+    Handles multi-stage builds (FROM <earlier stage> is skipped), --platform
+    flags and ARGs declared before the first FROM, overridden by build_args.
+    """
+    args: Dict[str, str] = {}
+    stages = set()
+    images = []
+    seen_from = False
+
+    for parts in read_instructions(dockerfile_path):
+        keyword = parts[0].upper()
+        if keyword == 'ARG' and not seen_from:
+            for declaration in parts[1:]:
+                name, _, default = declaration.partition('=')
+                if build_args and name in build_args:
+                    args[name] = build_args[name]
+                else:
+                    args[name] = substitute_args(default, args) or ''
+        elif keyword == 'FROM':
+            seen_from = True
+            words = [p for p in parts[1:] if not p.startswith('--')]
+            if not words:
+                continue
+            image = substitute_args(words[0], args)
+            if len(words) >= 3 and words[1].upper() == 'AS':
+                stages.add(words[2].lower())
+            if not image or image.lower() in stages or image == 'scratch':
+                continue
+            if image not in images:
+                images.append(image)
+
+    return images
+
+
+def collect_base_images(projects: List[Dict]) -> Dict[str, List[str]]:
+    """Map each base image to the projects whose Dockerfile uses it"""
+    usage: Dict[str, List[str]] = {}
+    for project in projects:
+        if 'Dockerfile' not in project.get('files', []):
+            continue
+        try:
+            images = parse_base_images(os.path.join(project['path'], 'Dockerfile'))
+        except OSError:
+            continue
+        for image in images:
+            usage.setdefault(image, []).append(project['name'])
+    return usage
+
+
+class BaseImagePrefetcher:
+    """Keeps the base images of local projects pulled, on a schedule and with bounded concurrency"""
+
+    def __init__(self, projects_provider: Callable[[], List[Dict]], interval: int = 3600,
+                 max_concurrency: int = 2, log: Callable[[str], None] = print, docker_cmd: str = 'docker'):
+        self.projects_provider = projects_provider
+        self.interval = interval
+        self.log = log
+        self.docker_cmd = docker_cmd
+        self.executor = ThreadPoolExecutor(max_workers=max_concurrency, thread_name_prefix='image-prefetch')
+        self.lock = threading.Lock()
+        self.images: Dict[str, Dict] = {}
+        self.in_flight: Dict[str, object] = {}
+        self.stop_event = threading.Event()
+        self.thread = None
+        self.thread_pid = None
+
+    def start(self):
+        """Start the background refresh loop, once per process (a forked worker does not inherit the thread)"""
+        with self.lock:
+            if self.thread_pid == os.getpid() or self.interval <= 0:
+                return
+            self.thread_pid = os.getpid()
+            self.thread = threading.Thread(target=self._run, daemon=True, name='image-prefetcher')
+            self.thread.start()
+
+    def stop(self):
+        self.stop_event.set()
+
+    def _run(self):
+        while not self.stop_event.is_set():
+            try:
+                self.refresh()
+            except Exception as e:
+                self.log(f"⚠️ Base image prefetch failed: {e}")
+            self.stop_event.wait(self.interval)
+
+    def refresh(self) -> List[str]:
+        """Queue a pull for every base image used by local projects"""
+        usage = collect_base_images(self.projects_provider())
+        for image, projects in usage.items():
+            with self.lock:
+                self.images.setdefault(image, {'image': image, 'status': 'pending', 'last_pulled': None, 'error': ''})
+                self.images[image]['projects'] = projects
+            self.pull(image)
+        return list(usage)
+
+    def pull(self, image: str):
+        """Queue a pull unless one is already running; returns the future"""
+        with self.lock:
+            if image in self.in_flight:
+                return self.in_flight[image]
+            self.images.setdefault(image, {'image': image, 'status': 'pending', 'last_pulled': None, 'error': '', 'projects': []})
+            future = self.executor.submit(self._pull, image)
+            self.in_flight[image] = future
+            return future
+
+    def _pull(self, image: str):
+        with self.lock:
+            self.images[image]['status'] = 'pulling'
+        try:
+            result = subprocess.run([self.docker_cmd, 'pull', '--quiet', image],
+                                    capture_output=True, text=True, timeout=1800)
+            with self.lock:
+                entry = self.images[image]
+                if result.returncode == 0:
+                    entry.update({'status': 'ready', 'last_pulled': datetime.now().isoformat(), 'error': ''})
+                else:
+                    entry.update({'status': 'failed', 'error': result.stderr.strip()[-500:]})
+            if result.returncode == 0:
+                self.log(f"📥 Prefetched base image {image}")
+            else:
+                self.log(f"⚠️ Could not prefetch base image {image}: {result.stderr.strip()}")
+        except Exception as e:
+            with self.lock:
+                self.images[image].update({'status': 'failed', 'error': str(e)})
+        finally:
+            with self.lock:
+                self.in_flight.pop(image, None)
+
+    def ensure(self, images: List[str], timeout: float = 0,
+               wake: Optional[threading.Event] = None) -> Dict[str, str]:
+        """Make sure the given images are pulled or being pulled; optionally wait for them.
+
+        Setting wake ends the wait early (a deploy sets it when it is aborted).
+        """
+        with self.lock:
+            missing = [image for image in images if self.images.get(image, {}).get('status') != 'ready']
+        futures = [self.pull(image) for image in missing]
+        if futures and timeout:
+            settled = wake or threading.Event()
+            pending = set(futures)
+            pending_lock = threading.Lock()
+
+            def done(future):
+                with pending_lock:
+                    pending.discard(future)
+                    if not pending:
+                        settled.set()
+            for future in futures:
+                future.add_done_callback(done)
+            settled.wait(timeout)
+        with self.lock:
+            return {image: self.images.get(image, {}).get('status', 'unknown') for image in images}
+
+    def status(self) -> List[Dict]:
+        with self.lock:
+            return [dict(entry) for entry in self.images.values()]
@@ -0,0 +1,346 @@
+"""Localhost load test for the deploy tool.
+
+Starts the app with shim `git` and `docker` binaries and a fake GitHub API,
+then opens N `/logs` SSE subscribers, submits M deploys and polls
+`/get-versions` and `/get-projects` while they run:
+
+    python loadtest.py --subscribers 50 --deploys 20
+
+Reports request latency percentiles, log delivery lag, dropped log lines,
+and the server's thread count and RSS. Nothing leaves 127.0.0.1.
+"""
+import argparse
+import json
+import os
+import shutil
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from collections import defaultdict
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import requests
+
+REPO_DIR = os.path.dirname(os.path.abspath(__file__))
+
+SHIM_GIT = '''#!{python}
+import os, sys, time
+time.sleep(float(os.environ.get('SHIM_DELAY', '0.05')))
+args = sys.argv[1:]
+while args and args[0] == '-c':
+    args = args[2:]
+command = args[0] if args else ''
+if command == 'status':
+    print('# branch.oid ' + 'a' * 40)
+    print('# branch.head main')
+elif command == 'ls-remote':
+    print('a' * 40 + '\\tHEAD')
+    print('a' * 40 + '\\trefs/heads/main')
+elif command == 'clone':
+    target = args[-1]
+    os.makedirs(target, exist_ok=True)
+    with open(os.path.join(target, 'Dockerfile'), 'w') as f:
+        f.write('FROM scratch\\nCOPY . .\\n')
+elif command == 'config':
+    sys.exit(1)
+'''
+
+SHIM_DOCKER = '''#!{python}
+import json, os, sys, time
+delay = float(os.environ.get('SHIM_DELAY', '0.05'))
+args = sys.argv[1:]
+command = args[0] if args else ''
+if command == 'build':
+    time.sleep(delay * 10)
+    print('#1 [1/1] FROM scratch')
+elif command == 'push':
+    time.sleep(delay * 5)
+    print(args[1] + ': digest: sha256:' + 'b' * 64 + ' size: 528')
+elif command in ('buildx', 'manifest'):
+    print(json.dumps({{'config': {{'size': 10}}, 'layers': [{{'size': 1000}}]}}))
+elif command == 'image' and args[1:2] == ['inspect']:
+    size = int(os.environ.get('SHIM_IMAGE_SIZE', '150000000'))
+    print(json.dumps([{{'Size': size, 'RootFS': {{'Layers': ['sha256:' + 'c' * 64, 'sha256:' + 'd' * 64]}}}}]))
+elif command == 'history':
+    size = int(os.environ.get('SHIM_IMAGE_SIZE', '150000000'))
+    print(json.dumps({{'CreatedBy': 'COPY . . # buildkit', 'Size': str(size - 1000)}}))
+    print(json.dumps({{'CreatedBy': '/bin/sh -c #(nop)  CMD [\"app\"]', 'Size': '0'}}))
+    print(json.dumps({{'CreatedBy': 'FROM scratch', 'Size': '1000'}}))
+elif command == 'save':
+    sys.exit(1)
+else:
+    time.sleep(delay)
+'''
+
+
+class FakeGitHubAPI(BaseHTTPRequestHandler):
+    """Just enough of the GitHub REST API for the deploy pipeline"""
+
+    def _reply(self, status, body):
+        data = json.dumps(body).encode()
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def do_GET(self):
+        if self.path.endswith('/contents') or self.path.startswith('/user/repos'):
+            self._reply(200, [])
+        else:
+            self._reply(200, {'full_name': self.path.split('/repos/')[-1], 'default_branch': 'main'})
+
+    def do_POST(self):
+        self._reply(201, {'full_name': 'loadtest/repo'})
+
+    def log_message(self, *args):
+        pass
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+def percentiles(values):
+    if not values:
+        return {'count': 0}
+    ordered = sorted(values)
+
+    def pick(p):
+        return round(ordered[min(len(ordered) - 1, int(p * len(ordered)))] * 1000, 1)
+    return {'count': len(ordered), 'p50_ms': pick(0.5), 'p95_ms': pick(0.95), 'p99_ms': pick(0.99),
+            'max_ms': round(ordered[-1] * 1000, 1)}
+
+
+def read_proc_status(pid):
+    """Threads and RSS (kB) of a process from /proc"""
+    stats = {}
+    try:
+        with open(f'/proc/{pid}/status') as f:
+            for line in f:
+                if line.startswith('Threads:'):
+                    stats['threads'] = int(line.split()[1])
+                elif line.startswith('VmRSS:'):
+                    stats['rss_kb'] = int(line.split()[1])
+    except OSError:
+        pass
+    return stats
+
+
+# Every endpoint the generators call; each gets a report row even if no request completed
+ENDPOINTS = ('deploy', 'get-versions', 'get-projects')
+
+
+class LoadTest:
+    def __init__(self, args):
+        self.args = args
+        self.base_url = f"http://127.0.0.1:{args.port or free_port()}"
+        self.stop_event = threading.Event()
+        self.lock = threading.Lock()
+        self.latencies = defaultdict(list)
+        self.errors = defaultdict(int)
+        self.timeouts = defaultdict(int)
+        self.in_flight = defaultdict(int)
+        self.submitted_at = {}
+        self.first_delivery = {}
+        self.received = defaultdict(int)
+        self.connected = 0
+        self.process_samples = []
+
+    # Environment
+
+    def setup(self):
+        self.work_dir = tempfile.mkdtemp(prefix='deploy-loadtest-')
+        shim_dir = os.path.join(self.work_dir, 'bin')
+        workspace = os.path.join(self.work_dir, 'workspace')
+        projects_dir = os.path.join(self.work_dir, 'projects')
+        os.makedirs(shim_dir)
+        os.makedirs(workspace)
+        # /get-projects scans these instead of the real folders next to the repository
+        for i in range(self.args.projects):
+            project = os.path.join(projects_dir, f"LoadTest_{i}")
+            os.makedirs(project)
+            for filename, content in (('app.py', 'print("hello")\n'), ('requirements.txt', 'flask\n'),
+                                      ('Dockerfile', 'FROM python:3.11-slim\nCOPY . .\n')):
+                with open(os.path.join(project, filename), 'w') as f:
+                    f.write(content)
+        for name, template in (('git', SHIM_GIT), ('docker', SHIM_DOCKER)):
+            path = os.path.join(shim_dir, name)
+            with open(path, 'w') as f:
+                f.write(template.format(python=sys.executable))
+            os.chmod(path, 0o755)
+        # The pipeline expects to run from a project directory
+        for filename, content in (('app.py', 'print("hello")\n'), ('requirements.txt', ''), ('Dockerfile', 'FROM scratch\n')):
+            with open(os.path.join(workspace, filename), 'w') as f:
+                f.write(content)
+
+        self.api = ThreadingHTTPServer(('127.0.0.1', 0), FakeGitHubAPI)
+        threading.Thread(target=self.api.serve_forever, daemon=True).start()
+
+        port = int(self.base_url.rsplit(':', 1)[1])
+        env = dict(os.environ,
+                   PATH=shim_dir + os.pathsep + os.environ.get('PATH', ''),
+                   SHIM_DELAY=str(self.args.shim_delay),
+                   GITHUB_API_URL=f"http://127.0.0.1:{self.api.server_address[1]}",
+                   ARTIFACT_STORE_DIR=os.path.join(self.work_dir, 'artifacts'),
+                   DEPLOY_STATE_DB=os.path.join(self.work_dir, 'deploy_state.db'),
+                   PROFILE_DIR=os.path.join(self.work_dir, 'profiles'),
+                   PROJECTS_BASE_PATH=projects_dir)
+        self.server = subprocess.Popen(
+            # REPO_DIR goes ahead of the working directory, which has its own app.py
+            [sys.executable, '-c', f"import sys; sys.path.insert(0, {REPO_DIR!r}); import app; "
+                                   f"app.app.run(host='127.0.0.1', port={port}, threaded=True)"],
+            cwd=workspace, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        for _ in range(100):
+            try:
+                requests.get(f"{self.base_url}/webhook/status", timeout=1)
+                return
+            except requests.exceptions.RequestException:
+                time.sleep(0.1)
+        raise RuntimeError('App did not start')
+
+    def teardown(self):
+        self.stop_event.set()
+        self.server.terminate()
+        self.server.wait(timeout=10)
+        self.api.shutdown()
+        shutil.rmtree(self.work_dir, ignore_errors=True)
+
+    # Load generators
+
+    def timed(self, name, method, path, **kwargs):
+        started = time.perf_counter()
+        with self.lock:
+            self.in_flight[name] += 1
+        try:
+            response = requests.request(method, f"{self.base_url}{path}", timeout=self.args.request_timeout, **kwargs)
+            response.raise_for_status()
+            with self.lock:
+                self.latencies[name].append(time.perf_counter() - started)
+            return response
+        except requests.exceptions.Timeout:
+            with self.lock:
+                self.timeouts[name] += 1
+            return None
+        except requests.exceptions.RequestException:
+            with self.lock:
+                self.errors[name] += 1
+            return None
+        finally:
+            with self.lock:
+                self.in_flight[name] -= 1
+
+    def subscriber(self):
+        try:
+            with requests.get(f"{self.base_url}/logs", stream=True, timeout=(5, None)) as response:
+                with self.lock:
+                    self.connected += 1
+                for line in response.iter_lines(decode_unicode=True):
+                    if self.stop_event.is_set():
+                        break
+                    if not line or not line.startswith('data: '):
+                        continue
+                    message = json.loads(line[6:]).get('message', '')
+                    if '📦 Project: LoadTest_' in message:
+                        marker = message.rsplit('Project: ', 1)[1].strip()
+                        with self.lock:
+                            self.received[marker] += 1
+                            self.first_delivery.setdefault(marker, time.perf_counter())
+        except requests.exceptions.RequestException:
+            with self.lock:
+                self.errors['logs'] += 1
+
+    def poller(self):
+        payload = {'github_username': 'loadtest', 'github_token': 'token', 'project_name': 'LoadTest_0'}
+        while not self.stop_event.is_set():
+            self.timed('get-versions', 'POST', '/get-versions', json=payload)
+            self.timed('get-projects', 'GET', '/get-projects')
+            self.stop_event.wait(self.args.poll_interval)
+
+    def sample_process(self):
+        while not self.stop_event.is_set():
+            stats = read_proc_status(self.server.pid)
+            if stats:
+                self.process_samples.append(stats)
+            self.stop_event.wait(0.5)
+
+    def submit_deploys(self):
+        for i in range(self.args.deploys):
+            marker = f"LoadTest_{i}"
+            with self.lock:
+                self.submitted_at[marker] = time.perf_counter()
+            self.timed('deploy', 'POST', '/deploy', json={
+                'project_name': marker,
+                'github_username': 'loadtest',
+                'github_token': 'token',
+                'selected_repository': 'loadtest/repo'
+            })
+            time.sleep(self.args.deploy_interval)
+
+    # Run
+
+    def run(self):
+        self.setup()
+        try:
+            threads = [threading.Thread(target=self.subscriber, daemon=True) for _ in range(self.args.subscribers)]
+            threads += [threading.Thread(target=self.poller, daemon=True) for _ in range(self.args.pollers)]
+            threads.append(threading.Thread(target=self.sample_process, daemon=True))
+            for thread in threads:
+                thread.start()
+            deadline = time.time() + 10
+            while self.connected < self.args.subscribers and time.time() < deadline:
+                time.sleep(0.05)
+
+            self.submit_deploys()
+            self.stop_event.wait(self.args.duration)
+            return self.report()
+        finally:
+            self.teardown()
+
+    def report(self):
+        with self.lock:
+            lags = [self.first_delivery[m] - self.submitted_at[m] for m in self.first_delivery]
+            expected = self.args.deploys * self.args.subscribers
+            delivered = sum(self.received.values())
+            return {
+                'subscribers': {'requested': self.args.subscribers, 'connected': self.connected},
+                'deploys_submitted': self.args.deploys,
+                # Timed-out and still-running requests are listed so a slow endpoint cannot drop out of the report
+                'latency': {name: dict(percentiles(self.latencies[name]), errors=self.errors[name],
+                                       timeouts=self.timeouts[name], unfinished=self.in_flight[name])
+                            for name in ENDPOINTS},
+                'errors': dict(self.errors),
+                'log_delivery': {
+                    'lag_to_first_subscriber': percentiles(lags),
+                    'expected_lines': expected,
+                    'delivered_lines': delivered,
+                    'dropped_lines': expected - delivered
+                },
+                'server': {
+                    'max_threads': max((s.get('threads', 0) for s in self.process_samples), default=None),
+                    'max_rss_kb': max((s.get('rss_kb', 0) for s in self.process_samples), default=None),
+                    'final': self.process_samples[-1] if self.process_samples else {}
+                }
+            }
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Localhost load test for /logs subscribers and concurrent deploys')
+    parser.add_argument('--subscribers', type=int, default=20, help='concurrent /logs SSE connections')
+    parser.add_argument('--deploys', type=int, default=10, help='deploys to submit')
+    parser.add_argument('--deploy-interval', type=float, default=0.1, help='seconds between deploy submissions')
+    parser.add_argument('--pollers', type=int, default=2, help='threads polling /get-versions and /get-projects')
+    parser.add_argument('--poll-interval', type=float, default=0.5)
+    parser.add_argument('--duration', type=float, default=15, help='seconds to keep measuring after the last deploy')
+    parser.add_argument('--shim-delay', type=float, default=0.05, help='base latency of the shim git/docker commands')
+    parser.add_argument('--projects', type=int, default=5, help='local project folders for /get-projects to scan')
+    parser.add_argument('--request-timeout', type=float, default=30, help='seconds before a request counts as timed out')
+    parser.add_argument('--port', type=int, default=0)
+    args = parser.parse_args()
+
+    print(json.dumps(LoadTest(args).run(), indent=2))
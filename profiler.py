@@ -0,0 +1,109 @@
+import json
+import os
+import re
+import sys
+import threading
+import time
+from collections import Counter
+from datetime import datetime
+from typing import Dict, List, Optional
+
+
+def frame_label(frame) -> str:
+    code = frame.f_code
+    return f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})"
+
+
+class ProfileSession:
+    """Samples one thread's stack on a timer and records its wall-clock and CPU time.
+
+    start() and stop() must be called from the profiled thread so the CPU
+    clock (time.thread_time) belongs to it. The samples are written in the
+    folded-stack format read by flamegraph.pl, speedscope and similar tools.
+    """
+
+    def __init__(self, name: str, output_dir: str, interval: float = 0.005):
+        self.name = re.sub(r'[^A-Za-z0-9_.-]+', '_', name)
+        self.output_dir = output_dir
+        self.interval = interval
+        self.samples: Counter = Counter()
+        self.stop_event = threading.Event()
+        self.sampler = None
+        self.thread_id = None
+
+    def start(self):
+        self.thread_id = threading.get_ident()
+        self.started_at = datetime.now()
+        self.wall_start = time.perf_counter()
+        self.cpu_start = time.thread_time()
+        self.sampler = threading.Thread(target=self._sample, daemon=True, name=f'profiler-{self.name}')
+        self.sampler.start()
+
+    def _sample(self):
+        while not self.stop_event.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            if frame is None:
+                continue
+            stack = []
+            while frame is not None:
+                stack.append(frame_label(frame))
+                frame = frame.f_back
+            self.samples[';'.join(reversed(stack))] += 1
+
+    def stop(self) -> Dict:
+        """Stop sampling and write <name>.folded and <name>.json; returns the summary"""
+        wall = time.perf_counter() - self.wall_start
+        cpu = time.thread_time() - self.cpu_start
+        self.stop_event.set()
+        self.sampler.join()
+
+        os.makedirs(self.output_dir, exist_ok=True)
+        profile_id = f"{self.started_at.strftime('%Y%m%d_%H%M%S_%f')}-{self.name}"
+        with open(os.path.join(self.output_dir, profile_id + '.folded'), 'w') as f:
+            for stack, count in self.samples.most_common():
+                f.write(f"{stack} {count}\n")
+
+        summary = {
+            'profile_id': profile_id,
+            'name': self.name,
+            'started_at': self.started_at.isoformat(),
+            'wall_seconds': round(wall, 4),
+            'cpu_seconds': round(cpu, 4),
+            # Time the thread was not running Python/C code: subprocesses, network, disk, locks
+            'waiting_seconds': round(max(wall - cpu, 0), 4),
+            'samples': sum(self.samples.values()),
+            'interval': self.interval
+        }
+        with open(os.path.join(self.output_dir, profile_id + '.json'), 'w') as f:
+            json.dump(summary, f, indent=2)
+        return summary
+
+
+def profile_call(name: str, output_dir: str, func, *args, **kwargs):
+    """Run func under a ProfileSession in the current thread"""
+    session = ProfileSession(name, output_dir)
+    session.start()
+    try:
+        return func(*args, **kwargs)
+    finally:
+        session.stop()
+
+
+def list_profiles(output_dir: str) -> List[Dict]:
+    """Summaries of the stored profiles, newest first"""
+    if not os.path.isdir(output_dir):
+        return []
+    profiles = []
+    for filename in sorted(os.listdir(output_dir), reverse=True):
+        if filename.endswith('.json'):
+            with open(os.path.join(output_dir, filename), 'r') as f:
+                profiles.append(json.load(f))
+    return profiles
+
+
+def profile_file(output_dir: str, profile_id: str, extension: str) -> Optional[str]:
+    """Path of a stored profile file, or None if it does not exist"""
+    if not re.fullmatch(r'[A-Za-z0-9_.-]+', profile_id) or extension not in ('folded', 'json'):
+        return None
+    path = os.path.join(output_dir, f"{profile_id}.{extension}")
+    return path if os.path.exists(path) else None
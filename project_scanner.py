@@ -0,0 +1,107 @@
+import os
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from datetime import datetime
+from typing import Dict, Iterator, List
+
+README_FILES = ['README.md', 'README.txt', 'readme.md', 'readme.txt']
+IMPORTANT_FILES = ['app.py', 'main.py', 'index.html', 'package.json', 'requirements.txt', 'Dockerfile']
+
+# Fields that require walking the whole folder; everything else is cheap
+DETAIL_FIELDS = ('file_count', 'size', 'description')
+
+
+def list_project_folders(base_path: str) -> List[Dict]:
+    """List folders under base_path with only the fields that are cheap to compute"""
+    folders = []
+    if not os.path.exists(base_path):
+        return folders
+
+    for item in sorted(os.listdir(base_path)):
+        item_path = os.path.join(base_path, item)
+        if not os.path.isdir(item_path):
+            continue
+
+        folder_info = {
+            'name': item,
+            'path': item_path,
+            'has_git': os.path.exists(os.path.join(item_path, '.git')),
+            'full_path': item_path,
+            'files': [f for f in IMPORTANT_FILES if os.path.exists(os.path.join(item_path, f))],
+            'file_count': None,
+            'size': None,
+            'last_modified': '',
+            'description': '',
+            'details_pending': True
+        }
+        try:
+            folder_info['last_modified'] = datetime.fromtimestamp(
+                os.path.getmtime(item_path)
+            ).strftime('%Y-%m-%d %H:%M:%S')
+        except OSError:
+            pass
+
+        folders.append(folder_info)
+
+    return folders
+
+
+def read_description(item_path: str) -> str:
+    """Use the first few lines of a README as the folder description"""
+    for readme in README_FILES:
+        readme_path = os.path.join(item_path, readme)
+        if os.path.exists(readme_path):
+            try:
+                with open(readme_path, 'r', encoding='utf-8') as f:
+                    lines = f.read().split('\n')
+                description = ' '.join([line.strip() for line in lines[:3] if line.strip()])
+                return description[:200] + '...' if len(description) > 200 else description
+            except Exception:
+                pass
+    return ''
+
+
+def scan_project_details(item_path: str) -> Dict:
+    """Walk a folder and compute the expensive fields (file count, size, description)"""
+    file_count = 0
+    total_size = 0
+    for root, dirs, files in os.walk(item_path):
+        for file in files:
+            file_path = os.path.join(root, file)
+            try:
+                total_size += os.path.getsize(file_path)
+                file_count += 1
+            except OSError:
+                pass
+
+    return {
+        'file_count': file_count,
+        'size': total_size,
+        'description': read_description(item_path)
+    }
+
+
+class ProjectScanner:
+    """Computes project details in a background pool and yields them as they finish"""
+
+    def __init__(self, max_workers: int = 4):
+        self.executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='project-scan')
+
+    def stream_details(self, folders: List[Dict]) -> Iterator[Dict]:
+        """Yield one update per folder in completion order, so fast folders are not held back by slow ones"""
+        futures = {self.executor.submit(scan_project_details, folder['path']): folder for folder in folders}
+        for future in as_completed(futures):
+            folder = futures[future]
+            update = {'name': folder['name'], 'path': folder['path'], 'details_pending': False}
+            try:
+                update.update(future.result())
+            except Exception as e:
+                update['error'] = str(e)
+            yield update
+
+    def scan_all(self, folders: List[Dict]) -> List[Dict]:
+        """Fill in the details for every folder and return the completed list"""
+        by_path = {folder['path']: folder for folder in folders}
+        for update in self.stream_details(folders):
+            folder = by_path[update['path']]
+            folder.update({k: v for k, v in update.items() if k not in ('name', 'path')})
+        return folders
@@ -0,0 +1,72 @@
+import json
+import re
+import subprocess
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Dict, List
+
+from deploy_jobs import JobAborted
+
+# Last line of `docker push`: "<tag>: digest: sha256:<hex> size: <manifest bytes>"
+DIGEST_PATTERN = re.compile(r'digest: (sha256:[0-9a-f]{64}) size: (\d+)')
+
+
+def mirror_refs(image_ref: str, registries: List[str]) -> List[str]:
+    """The same repository:tag under each extra registry (registry may include a namespace)"""
+    repository_and_tag = image_ref.rsplit('/', 1)[-1]
+    return [f"{registry.rstrip('/')}/{repository_and_tag}" for registry in registries]
+
+
+def inspect_manifest(image_ref: str, digest: str, run: Callable = subprocess.run) -> Dict:
+    """Fetch the pushed manifest by digest; proves the registry has it and gives compressed layer sizes"""
+    reference = f"{image_ref.rsplit(':', 1)[0]}@{digest}"
+    for command in (['docker', 'buildx', 'imagetools', 'inspect', '--raw', reference],
+                    ['docker', 'manifest', 'inspect', reference]):
+        result = run(command, capture_output=True, text=True)
+        if result.returncode == 0:
+            manifest = json.loads(result.stdout)
+            if 'layers' in manifest:
+                return {'layers': [layer['size'] for layer in manifest['layers']],
+                        'config_size': manifest['config']['size']}
+            # Multi-platform index: report the platform manifests instead of layers
+            return {'manifests': [m['digest'] for m in manifest.get('manifests', [])], 'layers': []}
+    raise RuntimeError(f"Could not fetch manifest {reference}: {result.stderr.strip()}")
+
+
+def push_one(image_ref: str, run: Callable = subprocess.run) -> Dict:
+    """docker push one tag and verify it by digest"""
+    started = time.monotonic()
+    outcome = {'image': image_ref, 'ok': False, 'digest': None, 'manifest_size': None, 'layer_sizes': []}
+    try:
+        result = run(['docker', 'push', image_ref], check=True, capture_output=True, text=True)
+        match = DIGEST_PATTERN.search(result.stdout)
+        if not match:
+            raise RuntimeError('docker push did not report a digest')
+        outcome['digest'] = match.group(1)
+        outcome['manifest_size'] = int(match.group(2))
+        manifest = inspect_manifest(image_ref, outcome['digest'], run)
+        outcome['layer_sizes'] = manifest['layers']
+        outcome['ok'] = True
+    except JobAborted:
+        # A cancel or timeout ends the deploy, it is not a failed push
+        raise
+    except subprocess.CalledProcessError as e:
+        outcome['error'] = e.stderr.strip() or str(e)
+    except Exception as e:
+        outcome['error'] = str(e)
+    outcome['duration'] = round(time.monotonic() - started, 3)
+    return outcome
+
+
+def push_to_registries(image_ref: str, registries: List[str], run: Callable = subprocess.run) -> List[Dict]:
+    """Push image_ref and its mirror tags concurrently; the first result is the primary push.
+
+    run replaces subprocess.run for every docker command (a deploy job passes
+    its own so a cancel also kills the pushes).
+    """
+    mirrors = mirror_refs(image_ref, registries)
+    for mirror in mirrors:
+        run(['docker', 'tag', image_ref, mirror], check=True, capture_output=True)
+    targets = [image_ref] + mirrors
+    with ThreadPoolExecutor(max_workers=len(targets)) as executor:
+        return list(executor.map(lambda target: push_one(target, run), targets))
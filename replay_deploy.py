@@ -0,0 +1,116 @@
+"""Replay a recorded deploy trace offline.
+
+Runs the real deploy pipeline (run_deployment) with every command, GitHub
+API call and host-dependent step answered from a trace written by a deploy
+with "record": true, so no git, docker or network is needed:
+
+    python replay_deploy.py traces/deploy-MyApp-1a2b3c.jsonl --speed 10 --concurrency 4
+
+Each call waits its recorded duration divided by --speed (0 answers at
+once, which leaves only the orchestrator's own time). The app runs against
+a throwaway state database seeded with the version history the recorded
+deploy started from; its log goes to stderr. Prints JSON with the recorded
+and replayed duration, the final version status of each replay, and how
+the calls matched.
+"""
+import argparse
+import contextlib
+import json
+import os
+import shutil
+import sys
+import tempfile
+import threading
+import time
+
+REPO_DIR = os.path.dirname(os.path.abspath(__file__))
+
+
+def replay(args):
+    sys.path.insert(0, REPO_DIR)
+    from deploy_executors import REDACTED, ReplayExecutor, load_trace
+
+    trace = load_trace(os.path.abspath(args.trace))
+    header, footer = trace['header'], trace['footer']
+
+    work_dir = tempfile.mkdtemp(prefix='deploy-replay-')
+    workspace = os.path.join(work_dir, 'workspace')
+    os.makedirs(workspace)
+    # The pipeline checks for these files in its working directory; their contents are never read back
+    for filename in header.get('workspace', []):
+        open(os.path.join(workspace, filename), 'w').close()
+    os.environ.update(DEPLOY_STATE_DB=os.path.join(work_dir, 'deploy_state.db'),
+                      ARTIFACT_STORE_DIR=os.path.join(work_dir, 'artifacts'),
+                      TRACE_DIR=os.path.join(work_dir, 'traces'),
+                      PROFILE_DIR=os.path.join(work_dir, 'profiles'),
+                      BASE_IMAGE_PREFETCH_INTERVAL='0')
+    if header.get('github_api_url'):
+        # Same API URL as the recording, so requests match their events exactly
+        os.environ['GITHUB_API_URL'] = header['github_api_url']
+    os.chdir(workspace)
+    try:
+        import app
+        from admission import AdmissionController
+        from version_manager import VERSIONS_KEY
+
+        if header.get('versions') is not None:
+            app.shared_state.put_document(VERSIONS_KEY, header['versions'])
+        # Admission samples this host, which has nothing to do with the recorded one
+        app.build_admission = AdmissionController(max_load_per_cpu=float('inf'), max_memory_pressure=float('inf'),
+                                                  min_memory_available=0, min_free_disk=0, settle=0,
+                                                  state=app.shared_state)
+
+        payload = dict(header['payload'], record=False)
+        results = [None] * args.concurrency
+
+        def run_one(index):
+            job = app.deploy_jobs.create(header['project'])
+            executor = ReplayExecutor(job, trace, speed=args.speed, secrets=[REDACTED])
+            started = time.monotonic()
+            error = None
+            try:
+                app.run_deployment(payload, job, executor)
+            except Exception as e:
+                error = str(e)
+            results[index] = dict({
+                'version_status': app.deployment_status(job.version_id),
+                'duration': round(time.monotonic() - started, 3),
+                'error': error
+            }, **executor.report())
+
+        started = time.monotonic()
+        threads = [threading.Thread(target=run_one, args=(i,)) for i in range(args.concurrency)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        recorded = footer['duration'] if footer else None
+        return {
+            'trace': args.trace,
+            'speed': args.speed,
+            'recorded': {
+                'duration': recorded,
+                'version_status': footer.get('version_status') if footer else None,
+                'events': len(trace['events'])
+            },
+            'expected_duration': round(recorded / args.speed, 3) if recorded and args.speed > 0 else None,
+            'wall_time': round(time.monotonic() - started, 3),
+            'replays': results
+        }
+    finally:
+        os.chdir(REPO_DIR)
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Replay a recorded deploy trace without git, docker or network')
+    parser.add_argument('trace', help='trace file written by a deploy with "record": true')
+    parser.add_argument('--speed', type=float, default=1.0,
+                        help='time compression: 1 replays at recorded speed, 10 ten times faster, 0 without waits')
+    parser.add_argument('--concurrency', type=int, default=1, help='replays of the trace to run at the same time')
+    args = parser.parse_args()
+
+    # The deploy log goes to stderr, the report to stdout
+    with contextlib.redirect_stdout(sys.stderr):
+        report = replay(args)
+    print(json.dumps(report, indent=2))
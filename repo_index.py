@@ -0,0 +1,240 @@
+import json
+import re
+import threading
+import time
+from typing import Dict, List, Optional
+
+import requests
+
+from shared_state import SharedState
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS repo_index (
+    account TEXT NOT NULL,
+    full_name TEXT NOT NULL,
+    name TEXT NOT NULL,
+    name_words TEXT NOT NULL,
+    updated_at TEXT NOT NULL,
+    search_text TEXT NOT NULL,
+    data TEXT NOT NULL,
+    PRIMARY KEY (account, full_name)
+);
+CREATE INDEX IF NOT EXISTS repo_index_updated ON repo_index (account, updated_at);
+CREATE TABLE IF NOT EXISTS repo_trigrams (
+    account TEXT NOT NULL,
+    full_name TEXT NOT NULL,
+    trigram TEXT NOT NULL,
+    PRIMARY KEY (account, full_name, trigram)
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS repo_trigrams_lookup ON repo_trigrams (account, trigram, full_name);
+CREATE TABLE IF NOT EXISTS repo_index_meta (
+    account TEXT PRIMARY KEY,
+    newest_updated_at TEXT,
+    refreshed REAL NOT NULL,
+    full_refreshed REAL NOT NULL
+);
+"""
+
+
+def repo_info(repo: Dict) -> Dict:
+    """The fields of a GitHub API repository object that the tool shows and searches"""
+    return {
+        'name': repo['name'],
+        'full_name': repo['full_name'],
+        'description': repo.get('description', 'No description'),
+        'private': repo['private'],
+        'fork': repo['fork'],
+        'language': repo.get('language', 'Unknown'),
+        'stars': repo['stargazers_count'],
+        'forks': repo['forks_count'],
+        'size': repo['size'],
+        'created_at': repo['created_at'],
+        'updated_at': repo['updated_at'],
+        'default_branch': repo['default_branch'],
+        'topics': repo.get('topics', []),
+        'homepage': repo.get('homepage', ''),
+        'has_issues': repo['has_issues'],
+        'has_wiki': repo['has_wiki'],
+        'has_pages': repo['has_pages'],
+        'archived': repo['archived']
+    }
+
+
+def name_words(name: str) -> str:
+    """' deploy tool' for Deploy_Tool: each part of the name after a space, for word-prefix LIKEs"""
+    return ' ' + ' '.join(word for word in re.split(r'[-_.]+', name.lower()) if word)
+
+
+def search_text(info: Dict) -> str:
+    """Lowercased searchable text; every word starts after a space so ' term' matches word prefixes"""
+    name = info['name'].lower()
+    words = [name] + name_words(name).split()
+    words += (info.get('description') or '').lower().split()
+    words += [(info.get('language') or '').lower()] + [topic.lower() for topic in info.get('topics') or []]
+    return ' ' + ' '.join(word for word in words if word)
+
+
+def trigrams(text: str) -> set:
+    return {text[i:i + 3] for i in range(len(text) - 2)}
+
+
+def like_escape(term: str) -> str:
+    return term.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_')
+
+
+class RepoIndex:
+    """Local, searchable copy of the repository metadata of each GitHub account.
+
+    Stored in the shared SQLite database next to the logs and jobs, so every
+    worker answers searches from it without calling the API. Terms of three
+    or more characters are looked up through a trigram table and then
+    checked as substrings; shorter ones match word prefixes. Refreshes are
+    incremental: only repositories updated since the newest one already
+    indexed are fetched, with a full re-listing every `full_refresh_interval`
+    seconds to drop deleted repositories.
+    """
+
+    def __init__(self, state: SharedState, api_url: str, full_refresh_interval: float = 86400):
+        self.state = state
+        self.api_url = api_url.rstrip('/')
+        self.full_refresh_interval = full_refresh_interval
+        self.refresh_lock = threading.Lock()
+        self.refreshing = set()
+        self.state.connection().executescript(SCHEMA)
+
+    # Writing
+
+    def upsert(self, account: str, repos: List[Dict]) -> int:
+        """Add or update repo_info() entries; returns how many were new or changed"""
+        account = account.lower()
+        changed = 0
+        with self.state.transaction() as conn:
+            indexed = dict(conn.execute('SELECT full_name, updated_at FROM repo_index WHERE account = ?', (account,)))
+            for info in repos:
+                if indexed.get(info['full_name']) == info['updated_at']:
+                    continue
+                changed += 1
+                text = search_text(info)
+                conn.execute('INSERT OR REPLACE INTO repo_index '
+                             '(account, full_name, name, name_words, updated_at, search_text, data) '
+                             'VALUES (?, ?, ?, ?, ?, ?, ?)',
+                             (account, info['full_name'], info['name'].lower(), name_words(info['name']),
+                              info['updated_at'], text, json.dumps(info)))
+                conn.execute('DELETE FROM repo_trigrams WHERE account = ? AND full_name = ?',
+                             (account, info['full_name']))
+                conn.executemany('INSERT INTO repo_trigrams (account, full_name, trigram) VALUES (?, ?, ?)',
+                                 [(account, info['full_name'], trigram) for trigram in trigrams(text)])
+        return changed
+
+    def fetch(self, token: str, since: Optional[str] = None) -> List[Dict]:
+        """Every repository the token can see (or those updated after since), newest first"""
+        session = requests.Session()
+        session.headers.update({'Authorization': f'token {token}', 'Accept': 'application/vnd.github.v3+json'})
+        params = {'per_page': 100, 'sort': 'updated', 'direction': 'desc'}
+        if since:
+            params['since'] = since
+        url = f'{self.api_url}/user/repos'
+        repos = []
+        while url:
+            response = session.get(url, params=params, timeout=15)
+            if response.status_code != 200:
+                raise RuntimeError(f"Could not list repositories: {response.status_code} - {response.text}")
+            page = [repo_info(repo) for repo in response.json()]
+            # >= since: another repository may have been updated in the same second as the newest indexed one
+            fresh = [info for info in page if not since or info['updated_at'] >= since]
+            repos += fresh
+            # Sorted by update time: once a page reaches since, the rest is already indexed
+            if len(fresh) < len(page):
+                break
+            url = response.links.get('next', {}).get('url')
+            params = None
+        return repos
+
+    def refresh(self, account: str, token: str, full: bool = False) -> Dict:
+        """Bring the account's index up to date; returns what changed"""
+        account = account.lower()
+        started = time.monotonic()
+        meta = self.meta(account)
+        full = full or meta is None or time.time() - meta['full_refreshed'] > self.full_refresh_interval
+        repos = self.fetch(token, None if full else meta['newest_updated_at'])
+        updated = self.upsert(account, repos)
+        removed = 0
+        with self.state.transaction() as conn:
+            if full:
+                keep = {info['full_name'] for info in repos}
+                stale = [row[0] for row in conn.execute('SELECT full_name FROM repo_index WHERE account = ?', (account,))
+                         if row[0] not in keep]
+                for full_name in stale:
+                    conn.execute('DELETE FROM repo_index WHERE account = ? AND full_name = ?', (account, full_name))
+                    conn.execute('DELETE FROM repo_trigrams WHERE account = ? AND full_name = ?', (account, full_name))
+                removed = len(stale)
+            newest = conn.execute('SELECT MAX(updated_at) FROM repo_index WHERE account = ?', (account,)).fetchone()[0]
+            now = time.time()
+            conn.execute('INSERT OR REPLACE INTO repo_index_meta (account, newest_updated_at, refreshed, full_refreshed) '
+                         'VALUES (?, ?, ?, ?)',
+                         (account, newest, now, now if full else meta['full_refreshed']))
+        return {'account': account, 'full': full, 'updated': updated, 'removed': removed,
+                'duration': round(time.monotonic() - started, 3)}
+
+    def refresh_in_background(self, account: str, token: str, log=print) -> bool:
+        """Start a refresh unless one is already running for account in this process"""
+        account = account.lower()
+        with self.refresh_lock:
+            if account in self.refreshing:
+                return False
+            self.refreshing.add(account)
+
+        def run():
+            try:
+                result = self.refresh(account, token)
+                if result['updated'] or result['removed']:
+                    log(f"🔎 Repository index for {account}: {result['updated']} updated, "
+                        f"{result['removed']} removed ({'full' if result['full'] else 'incremental'}, {result['duration']:.2f}s)")
+            except Exception as e:
+                log(f"⚠️ Could not refresh the repository index for {account}: {e}")
+            finally:
+                with self.refresh_lock:
+                    self.refreshing.discard(account)
+        threading.Thread(target=run, daemon=True).start()
+        return True
+
+    # Reading
+
+    def meta(self, account: str) -> Optional[Dict]:
+        row = self.state.connection().execute(
+            'SELECT newest_updated_at, refreshed, full_refreshed FROM repo_index_meta WHERE account = ?',
+            (account.lower(),)).fetchone()
+        if row is None:
+            return None
+        count = self.state.connection().execute('SELECT COUNT(*) FROM repo_index WHERE account = ?',
+                                                (account.lower(),)).fetchone()[0]
+        return {'newest_updated_at': row[0], 'refreshed': row[1], 'full_refreshed': row[2], 'repositories': count}
+
+    def search(self, account: str, query: str, limit: int = 20) -> List[Dict]:
+        """Repositories matching every word of query, best match first (name prefix, name word, anywhere)"""
+        account = account.lower()
+        terms = query.lower().split()
+        sql = 'SELECT data FROM repo_index WHERE account = ?'
+        params: List = [account]
+        for term in terms:
+            if len(term) >= 3:
+                grams = sorted(trigrams(term))
+                # Without table statistics SQLite would walk the primary key instead
+                sql += (' AND full_name IN (SELECT full_name FROM repo_trigrams INDEXED BY repo_trigrams_lookup'
+                        ' WHERE account = ? AND trigram IN '
+                        f"({', '.join('?' * len(grams))}) GROUP BY full_name HAVING COUNT(*) = ?)"
+                        " AND search_text LIKE ? ESCAPE '\\'")
+                params += [account] + grams + [len(grams), f'%{like_escape(term)}%']
+            else:
+                sql += " AND search_text LIKE ? ESCAPE '\\'"
+                params.append(f'% {like_escape(term)}%')
+        if terms:
+            # Name starts with the first word, then a part of the name does, then the name contains it
+            first = like_escape(terms[0])
+            sql += (" ORDER BY CASE WHEN name LIKE ? ESCAPE '\\' THEN 0 WHEN name_words LIKE ? ESCAPE '\\' THEN 1"
+                    " WHEN name LIKE ? ESCAPE '\\' THEN 2 ELSE 3 END, updated_at DESC LIMIT ?")
+            params += [f'{first}%', f'% {first}%', f'%{first}%', limit]
+        else:
+            sql += ' ORDER BY updated_at DESC LIMIT ?'
+            params.append(limit)
+        return [json.loads(row[0]) for row in self.state.connection().execute(sql, params)]
@@ -0,0 +1,172 @@
+import json
+import os
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+from typing import Dict, List, Optional, Tuple
+
+# One database per host: every worker process of the app opens the same file
+DEFAULT_DB_PATH = os.environ.get('DEPLOY_STATE_DB',
+                                 os.path.join(os.path.dirname(os.path.abspath(__file__)), 'deploy_state.db'))
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS logs (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    created REAL NOT NULL,
+    message TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS jobs (
+    job_id TEXT PRIMARY KEY,
+    worker TEXT NOT NULL,
+    status TEXT NOT NULL,
+    cancel_requested INTEGER NOT NULL DEFAULT 0,
+    updated REAL NOT NULL,
+    data TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS jobs_updated ON jobs (updated);
+CREATE TABLE IF NOT EXISTS documents (
+    key TEXT PRIMARY KEY,
+    data TEXT NOT NULL
+);
+"""
+
+
+class SharedState:
+    """State shared by all worker processes: the log bus, the job table and JSON documents.
+
+    Backed by SQLite in WAL mode, so log subscribers keep reading while a
+    deploy writes. Each thread gets its own connection; transaction() takes
+    the write lock up front (BEGIN IMMEDIATE) for read-modify-write updates.
+    """
+
+    def __init__(self, path: str, keep_logs: int = 10000):
+        self.path = path
+        self.keep_logs = keep_logs
+        self.local = threading.local()
+        self.appends = 0
+        self.connection().executescript(SCHEMA)
+
+    def connection(self) -> sqlite3.Connection:
+        conn = getattr(self.local, 'conn', None)
+        if conn is None:
+            # Autocommit; multi-statement updates go through transaction()
+            conn = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('PRAGMA synchronous=NORMAL')
+            self.local.conn = conn
+            self.local.depth = 0
+        return conn
+
+    @contextmanager
+    def transaction(self):
+        """Serialize a read-modify-write against every other thread and process (nests)"""
+        conn = self.connection()
+        if self.local.depth:
+            self.local.depth += 1
+            try:
+                yield conn
+            finally:
+                self.local.depth -= 1
+            return
+        conn.execute('BEGIN IMMEDIATE')
+        self.local.depth = 1
+        try:
+            yield conn
+            conn.execute('COMMIT')
+        except BaseException:
+            conn.execute('ROLLBACK')
+            raise
+        finally:
+            self.local.depth = 0
+
+    # Log bus
+
+    def append_log(self, message: str) -> int:
+        conn = self.connection()
+        log_id = conn.execute('INSERT INTO logs (created, message) VALUES (?, ?)', (time.time(), message)).lastrowid
+        self.appends += 1
+        if self.appends % 1000 == 0:
+            conn.execute('DELETE FROM logs WHERE id <= ?', (log_id - self.keep_logs,))
+        return log_id
+
+    def read_logs(self, after_id: int, limit: int = 500) -> List[Tuple[int, str]]:
+        """Messages with an id above after_id, oldest first"""
+        return self.connection().execute('SELECT id, message FROM logs WHERE id > ? ORDER BY id LIMIT ?',
+                                         (after_id, limit)).fetchall()
+
+    def last_log_id(self) -> int:
+        return self.connection().execute('SELECT COALESCE(MAX(id), 0) FROM logs').fetchone()[0]
+
+    # Jobs
+
+    def save_job(self, job: Dict, worker: str):
+        self.connection().execute(
+            'INSERT INTO jobs (job_id, worker, status, updated, data) VALUES (?, ?, ?, ?, ?) '
+            'ON CONFLICT(job_id) DO UPDATE SET status = excluded.status, updated = excluded.updated, data = excluded.data',
+            (job['job_id'], worker, job['status'], time.time(), json.dumps(job)))
+
+    def get_job(self, job_id: str) -> Optional[Dict]:
+        row = self.connection().execute('SELECT worker, cancel_requested, data FROM jobs WHERE job_id = ?',
+                                        (job_id,)).fetchone()
+        if row is None:
+            return None
+        return dict(json.loads(row[2]), worker=row[0], cancel_requested=bool(row[1]))
+
+    def list_jobs(self, limit: int = 100) -> List[Dict]:
+        """Newest first, across all workers"""
+        rows = self.connection().execute('SELECT worker, cancel_requested, data FROM jobs ORDER BY updated DESC LIMIT ?',
+                                         (limit,)).fetchall()
+        return [dict(json.loads(data), worker=worker, cancel_requested=bool(cancel)) for worker, cancel, data in rows]
+
+    def request_cancel(self, job_id: str) -> Optional[bool]:
+        """Flag a running job for its worker to cancel; None if unknown, False if it is not running"""
+        with self.transaction() as conn:
+            row = conn.execute('SELECT status FROM jobs WHERE job_id = ?', (job_id,)).fetchone()
+            if row is None:
+                return None
+            if row[0] != 'running':
+                return False
+            conn.execute('UPDATE jobs SET cancel_requested = 1 WHERE job_id = ?', (job_id,))
+            return True
+
+    def cancel_requests(self, worker: str) -> List[str]:
+        rows = self.connection().execute(
+            "SELECT job_id FROM jobs WHERE worker = ? AND status = 'running' AND cancel_requested = 1",
+            (worker,)).fetchall()
+        return [row[0] for row in rows]
+
+    def running_jobs(self) -> List[Tuple[str, str]]:
+        """(job_id, worker) of every job still marked running"""
+        return self.connection().execute("SELECT job_id, worker FROM jobs WHERE status = 'running'").fetchall()
+
+    def mark_job(self, job_id: str, status: str, message: str):
+        with self.transaction() as conn:
+            row = conn.execute('SELECT data FROM jobs WHERE job_id = ?', (job_id,)).fetchone()
+            if row:
+                job = dict(json.loads(row[0]), status=status, message=message)
+                conn.execute('UPDATE jobs SET status = ?, updated = ?, data = ? WHERE job_id = ?',
+                             (status, time.time(), json.dumps(job), job_id))
+
+    # Documents
+
+    def get_document(self, key: str) -> Optional[Dict]:
+        row = self.connection().execute('SELECT data FROM documents WHERE key = ?', (key,)).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def put_document(self, key: str, document: Dict):
+        self.connection().execute('INSERT OR REPLACE INTO documents (key, data) VALUES (?, ?)',
+                                  (key, json.dumps(document)))
+
+
+_instances: Dict[str, SharedState] = {}
+_instances_lock = threading.Lock()
+
+
+def open_state(path: str = DEFAULT_DB_PATH) -> SharedState:
+    """The process-wide SharedState for path"""
+    path = os.path.abspath(path)
+    with _instances_lock:
+        if path not in _instances:
+            _instances[path] = SharedState(path)
+        return _instances[path]
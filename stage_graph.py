@@ -0,0 +1,135 @@
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from typing import Any, Callable, Dict, List, Optional
+
+
+class StageFailed(Exception):
+    """Raised by a stage to stop the pipeline with a readable message"""
+
+
+class Stage:
+    def __init__(self, name: str, func: Callable[[threading.Event], Any], depends_on: Optional[List[str]] = None):
+        self.name = name
+        self.func = func
+        self.depends_on = depends_on or []
+
+
+class StageGraph:
+    """Runs stages concurrently as soon as their dependencies succeed.
+
+    The first failure ends the run at once: the cancel event is set, pending
+    stages are skipped, and stages still running are marked cancelled and
+    left behind. on_cancel is called at that point to stop what they are
+    waiting on; a deploy passes its job's process killer.
+    """
+
+    def __init__(self, max_workers: int = 4, on_cancel: Optional[Callable[[], None]] = None):
+        self.stages: Dict[str, Stage] = {}
+        self.max_workers = max_workers
+        self.on_cancel = on_cancel
+
+    def add_stage(self, name: str, func: Callable[[threading.Event], Any], depends_on: Optional[List[str]] = None):
+        """Register a stage; func receives the cancel event and its return value is kept in results"""
+        for dep in depends_on or []:
+            if dep not in self.stages:
+                raise ValueError(f"Stage {name} depends on unknown stage {dep}")
+        self.stages[name] = Stage(name, func, depends_on)
+        return self
+
+    def run(self) -> Dict:
+        """Run the graph and return results, per-stage timings and the critical path"""
+        cancel_event = threading.Event()
+        results: Dict[str, Any] = {}
+        timings: Dict[str, Dict] = {}
+        status = {name: 'pending' for name in self.stages}
+        failed_stage = None
+        error = None
+        graph_start = time.monotonic()
+        started_at: Dict[str, float] = {}
+        # Stages left running after a failure finish later; they must not touch the returned timings
+        timings_lock = threading.Lock()
+
+        def run_stage(stage: Stage):
+            started = started_at[stage.name] = time.monotonic()
+            try:
+                return stage.func(cancel_event)
+            finally:
+                with timings_lock:
+                    # A stage cancelled by a failure already has its timing up to the failure
+                    timings.setdefault(stage.name, {
+                        'start': round(started - graph_start, 3),
+                        'duration': round(time.monotonic() - started, 3)
+                    })
+
+        executor = ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix='stage')
+        running = {}
+        try:
+            while failed_stage is None:
+                for stage in self.stages.values():
+                    if status[stage.name] == 'pending' and all(status[d] == 'success' for d in stage.depends_on):
+                        status[stage.name] = 'running'
+                        running[executor.submit(run_stage, stage)] = stage.name
+                if not running:
+                    break
+
+                done, _ = wait(running, return_when=FIRST_COMPLETED)
+                for future in done:
+                    name = running.pop(future)
+                    try:
+                        results[name] = future.result()
+                        status[name] = 'success'
+                    except Exception as e:
+                        status[name] = 'failed'
+                        if failed_stage is None:
+                            failed_stage, error = name, e
+        finally:
+            if running:
+                # Fail fast: do not wait for the siblings of the failed stage
+                with timings_lock:
+                    cancel_event.set()
+                    now = time.monotonic()
+                    for name in running.values():
+                        status[name] = 'cancelled'
+                        started = started_at.get(name, now)
+                        timings[name] = {'start': round(started - graph_start, 3),
+                                         'duration': round(now - started, 3)}
+                if self.on_cancel:
+                    self.on_cancel()
+            executor.shutdown(wait=False, cancel_futures=True)
+
+        for name, state in status.items():
+            if state == 'pending':
+                status[name] = 'cancelled'
+
+        return {
+            'ok': failed_stage is None,
+            'failed_stage': failed_stage,
+            'error': error,
+            'results': results,
+            'status': status,
+            'timings': timings,
+            'total_duration': round(time.monotonic() - graph_start, 3),
+            'critical_path': self.critical_path(timings) if failed_stage is None else []
+        }
+
+    def critical_path(self, timings: Dict[str, Dict]) -> List[str]:
+        """Longest chain of dependent stages by measured duration"""
+        finish: Dict[str, float] = {}
+        previous: Dict[str, Optional[str]] = {}
+
+        def visit(name: str) -> float:
+            if name not in finish:
+                best_dep = max(self.stages[name].depends_on, key=visit, default=None)
+                previous[name] = best_dep
+                finish[name] = (visit(best_dep) if best_dep else 0.0) + timings.get(name, {}).get('duration', 0.0)
+            return finish[name]
+
+        if not self.stages:
+            return []
+        last = max(self.stages, key=visit)
+        path = []
+        while last:
+            path.append(last)
+            last = previous[last]
+        return list(reversed(path))
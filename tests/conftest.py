@@ -0,0 +1,15 @@
+import os
+import sys
+
+import pytest
+
+# The app is a set of flat modules next to app.py
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from shared_state import SharedState
+
+
+@pytest.fixture
+def state(tmp_path):
+    """A SharedState of its own, so tests never touch deploy_state.db"""
+    return SharedState(str(tmp_path / 'state.db'))
@@ -0,0 +1,136 @@
+import socket
+import subprocess
+import sys
+import threading
+import time
+
+import pytest
+
+from admission import AdmissionController
+from deploy_jobs import JobAborted
+
+
+class FakeJob:
+    def __init__(self, job_id):
+        self.job_id = job_id
+        self.aborted = False
+        self.holds = []
+
+    def check(self):
+        if self.aborted:
+            raise JobAborted('cancelled', 'Deploy cancelled')
+
+    def set_hold(self, position, reasons):
+        self.holds.append((position, reasons))
+
+
+@pytest.fixture
+def admission(state):
+    # Only the concurrency cap holds builds; the host's load, memory and disk never do
+    return AdmissionController(max_load_per_cpu=float('inf'), max_memory_pressure=float('inf'),
+                               min_memory_available=0, min_free_disk=0, max_concurrent=1, settle=0,
+                               poll_interval=0.05, docker_cmd='docker-not-installed', state=state)
+
+
+def acquire_in_thread(admission, job):
+    admitted = threading.Event()
+    errors = []
+
+    def run():
+        try:
+            admission.acquire(job, log=lambda message: None)
+            admitted.set()
+        except BaseException as e:
+            errors.append(e)
+
+    thread = threading.Thread(target=run, daemon=True)
+    thread.start()
+    return admitted, errors, thread
+
+
+def wait_for(condition, timeout=2.0):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        assert time.monotonic() < deadline, 'timed out'
+        time.sleep(0.01)
+
+
+def test_free_slot_is_taken_at_once(admission):
+    job = FakeJob('a')
+    admission.acquire(job, log=lambda message: None)
+
+    assert admission.status()['running'] == ['a']
+    assert job.holds == []
+
+
+def test_build_waits_for_a_slot_and_takes_it_on_release(admission):
+    admission.acquire(FakeJob('a'), log=lambda message: None)
+    second = FakeJob('b')
+    admitted, errors, _ = acquire_in_thread(admission, second)
+
+    wait_for(lambda: second.holds)
+    assert not admitted.is_set()
+    assert second.holds[0][0] == 1
+    assert '1 build(s) running (limit 1)' in second.holds[0][1]
+    assert [entry['job_id'] for entry in admission.status()['queue']] == ['b']
+
+    admission.release('a')
+    assert admitted.wait(2)
+    assert second.holds[-1] == (None, [])
+    assert admission.status()['running'] == ['b']
+    assert errors == []
+
+
+def test_queue_is_first_in_first_out(admission):
+    admission.acquire(FakeJob('a'), log=lambda message: None)
+    second, third = FakeJob('b'), FakeJob('c')
+    second_admitted, _, _ = acquire_in_thread(admission, second)
+    wait_for(lambda: second.holds)
+    third_admitted, _, _ = acquire_in_thread(admission, third)
+    wait_for(lambda: third.holds)
+
+    assert third.holds[0] == (2, ['1 build(s) ahead in the queue'])
+
+    admission.release('a')
+    assert second_admitted.wait(2)
+    assert not third_admitted.wait(0.2)
+    admission.release('b')
+    assert third_admitted.wait(2)
+
+
+def test_aborted_job_leaves_the_queue(admission):
+    admission.acquire(FakeJob('a'), log=lambda message: None)
+    job = FakeJob('b')
+    admitted, errors, thread = acquire_in_thread(admission, job)
+    wait_for(lambda: job.holds)
+
+    job.aborted = True
+    thread.join(2)
+
+    assert not admitted.is_set()
+    assert isinstance(errors[0], JobAborted)
+    assert job.holds[-1] == (None, [])
+    assert admission.status()['queue'] == []
+
+
+def test_release_can_be_repeated(admission):
+    admission.acquire(FakeJob('a'), log=lambda message: None)
+    admission.release('a')
+    admission.release('a')
+
+    assert admission.status()['running'] == []
+
+
+def test_slots_of_dead_workers_are_dropped(admission, state):
+    exited = subprocess.run([sys.executable, '-c', 'import os; print(os.getpid())'],
+                            capture_output=True, text=True, check=True)
+    dead_worker = f"{socket.gethostname()}:{exited.stdout.strip()}"
+    state.connection().execute(
+        'INSERT INTO build_slots (job_id, worker, running, enqueued, admitted) VALUES (?, ?, 1, ?, ?)',
+        ('lost', dead_worker, time.time(), time.time()))
+
+    job = FakeJob('a')
+    admission.acquire(job, log=lambda message: None)
+
+    assert job.holds == []
+    assert admission.status()['running'] == ['a']
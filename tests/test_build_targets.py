@@ -0,0 +1,85 @@
+import pytest
+
+from build_targets import discover_targets, is_affected, is_dockerfile
+
+
+@pytest.mark.parametrize('filename', [
+    'Dockerfile', 'Dockerfile.worker', 'Dockerfile.dev.arm64', 'api.Dockerfile',
+])
+def test_dockerfiles(filename):
+    assert is_dockerfile(filename)
+
+
+@pytest.mark.parametrize('filename', [
+    'Dockerfile.dockerignore', 'Dockerfile.bak', 'Dockerfile.orig', 'Dockerfile.worker.old',
+    'Dockerfile.SWP', 'Dockerfile~', 'Dockerfile.', '.Dockerfile', '.dockerignore',
+    'dockerfile', 'Dockerfile-notes.md', 'README.md',
+])
+def test_not_dockerfiles(filename):
+    assert not is_dockerfile(filename)
+
+
+def target(context='.', dockerfile='Dockerfile', sources=('.',), dockerignore=()):
+    return {'name': 'app', 'dockerfile': dockerfile, 'context': context,
+            'sources': list(sources), 'dockerignore': list(dockerignore)}
+
+
+def test_unknown_changes_affect_every_target():
+    affected, reason = is_affected(target(), None)
+    assert affected
+    assert 'unknown' in reason
+
+
+def test_no_changes_affect_nothing():
+    assert is_affected(target(), []) == (False, 'no changes in its build inputs')
+
+
+def test_dockerfile_change():
+    assert is_affected(target(context='api', dockerfile='api/Dockerfile', sources=['src']),
+                       ['api/Dockerfile']) == (True, 'api/Dockerfile changed')
+
+
+def test_changes_outside_the_context_are_ignored():
+    api = target(context='api', dockerfile='api/Dockerfile')
+    assert not is_affected(api, ['web/index.html', 'apiary/main.py'])[0]
+    assert is_affected(api, ['api/main.py'])[0]
+
+
+def test_only_copied_sources_count():
+    app = target(sources=['src', 'requirements.txt', 'config/*.yaml'])
+    assert not is_affected(app, ['docs/index.md'])[0]
+    assert is_affected(app, ['src/app/main.py']) == (True, 'src/app/main.py is copied by Dockerfile')
+    assert is_affected(app, ['requirements.txt'])[0]
+    assert is_affected(app, ['config/prod.yaml'])[0]
+    assert not is_affected(app, ['srcs/main.py'])[0]
+
+
+def test_dockerignored_files_do_not_count():
+    app = target(dockerignore=['*.md', 'tests/', '!KEEP.md'])
+    assert not is_affected(app, ['README.md', 'tests/test_app.py'])[0]
+    assert is_affected(app, ['KEEP.md'])[0]
+    assert is_affected(app, ['main.py'])[0]
+
+
+def test_dockerignore_change_affects_its_context():
+    assert is_affected(target(context='api', dockerfile='api/Dockerfile', sources=['src']),
+                       ['api/.dockerignore'])[0]
+
+
+def test_discover_targets(tmp_path):
+    (tmp_path / 'Dockerfile').write_text('FROM python:3.12\nCOPY requirements.txt /app/\nCOPY src /app/src\n')
+    (tmp_path / 'Dockerfile.bak').write_text('FROM python:3.11\n')
+    worker = tmp_path / 'services' / 'worker'
+    worker.mkdir(parents=True)
+    (worker / 'Dockerfile.gpu').write_text('FROM base AS build\nCOPY --from=build /out /out\nADD ["run.sh", "/"]\n')
+    (worker / '.dockerignore').write_text('# comment\n*.log\n')
+
+    targets = {t['dockerfile']: t for t in discover_targets(str(tmp_path))}
+
+    assert sorted(targets) == ['Dockerfile', 'services/worker/Dockerfile.gpu']
+    assert targets['Dockerfile']['sources'] == ['requirements.txt', 'src']
+    gpu = targets['services/worker/Dockerfile.gpu']
+    assert gpu['name'] == 'services-worker-gpu'
+    assert gpu['context'] == 'services/worker'
+    assert gpu['sources'] == ['run.sh']
+    assert gpu['dockerignore'] == ['*.log']
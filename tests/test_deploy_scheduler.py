@@ -0,0 +1,108 @@
+import threading
+import time
+
+import pytest
+
+from deploy_scheduler import DeployScheduler
+
+
+class Runner:
+    """Records deploys; each one blocks until release() so tests can push while it runs"""
+
+    def __init__(self):
+        self.calls = []
+        self.started = threading.Semaphore(0)
+        self.gate = threading.Event()
+
+    def __call__(self, repo, commit, params):
+        self.calls.append((repo, commit, params))
+        self.started.release()
+        self.gate.wait(5)
+
+    def wait_started(self, timeout=2.0):
+        assert self.started.acquire(timeout=timeout), 'no deploy started'
+
+
+@pytest.fixture
+def runner():
+    runner = Runner()
+    yield runner
+    runner.gate.set()
+
+
+def scheduler(runner, state, **kwargs):
+    kwargs.setdefault('debounce', 0.1)
+    kwargs.setdefault('max_wait', 5.0)
+    return DeployScheduler(runner, state=state, log=lambda message: None, poll_interval=0.05, **kwargs)
+
+
+def test_burst_is_coalesced_into_the_newest_commit(runner, state):
+    deploys = scheduler(runner, state)
+
+    assert deploys.submit('o/r', 'a' * 40, {'branch': 'main'}) == 'queued'
+    assert deploys.submit('o/r', 'b' * 40, {'branch': 'main'}) == 'coalesced'
+    runner.wait_started()
+
+    assert runner.calls == [('o/r', 'b' * 40, {'branch': 'main'})]
+    assert deploys.status()['counters'] == {'received': 2, 'coalesced': 1, 'dropped': 0, 'started': 1}
+
+
+def test_push_of_the_running_commit_is_dropped(runner, state):
+    deploys = scheduler(runner, state)
+    deploys.submit('o/r', 'a' * 40)
+    runner.wait_started()
+
+    assert deploys.submit('o/r', 'a' * 40) == 'dropped'
+    assert deploys.status()['repos']['o/r']['running_commit'] == 'a' * 40
+
+
+def test_next_deploy_waits_for_the_running_one(runner, state):
+    deploys = scheduler(runner, state)
+    deploys.submit('o/r', 'a' * 40)
+    runner.wait_started()
+
+    assert deploys.submit('o/r', 'b' * 40) == 'queued'
+    time.sleep(0.3)
+    assert [commit for _, commit, _ in runner.calls] == ['a' * 40]
+
+    runner.gate.set()
+    runner.wait_started()
+    assert [commit for _, commit, _ in runner.calls] == ['a' * 40, 'b' * 40]
+
+
+def test_repositories_are_scheduled_independently(runner, state):
+    deploys = scheduler(runner, state)
+    deploys.submit('o/one', 'a' * 40)
+    deploys.submit('o/two', 'b' * 40)
+    runner.wait_started()
+    runner.wait_started()
+
+    assert sorted(repo for repo, _, _ in runner.calls) == ['o/one', 'o/two']
+
+
+def test_max_wait_bounds_a_steady_stream_of_pushes(runner, state):
+    # Pushes arrive faster than the debounce, so only max_wait can start the deploy
+    deploys = scheduler(runner, state, debounce=0.3, max_wait=0.6)
+    started = time.monotonic()
+    for i in range(20):
+        deploys.submit('o/r', str(i % 10) * 40)
+        if runner.started.acquire(timeout=0.1):
+            break
+    elapsed = time.monotonic() - started
+
+    assert len(runner.calls) == 1
+    assert 0.5 < elapsed < 1.5
+
+
+def test_schedulers_on_one_state_share_pending_deploys(runner, state):
+    # Two schedulers on one database stand in for two worker processes
+    first = scheduler(runner, state)
+    second = scheduler(runner, state)
+
+    assert first.submit('o/r', 'a' * 40) == 'queued'
+    assert second.submit('o/r', 'b' * 40) == 'coalesced'
+    runner.wait_started()
+    assert second.submit('o/r', 'b' * 40) == 'dropped'
+
+    time.sleep(0.3)
+    assert runner.calls == [('o/r', 'b' * 40, {})]
@@ -0,0 +1,116 @@
+import threading
+import time
+
+from stage_graph import StageFailed, StageGraph
+
+
+def test_stages_wait_for_their_dependencies():
+    order = []
+    graph = StageGraph()
+    graph.add_stage('checkout', lambda cancel: order.append('checkout') or 'sha')
+    graph.add_stage('lint', lambda cancel: order.append('lint'), depends_on=['checkout'])
+    graph.add_stage('build', lambda cancel: order.append('build'), depends_on=['checkout'])
+
+    outcome = graph.run()
+
+    assert outcome['ok']
+    assert order[0] == 'checkout'
+    assert sorted(order[1:]) == ['build', 'lint']
+    assert outcome['results']['checkout'] == 'sha'
+    assert set(outcome['status'].values()) == {'success'}
+
+
+def test_unknown_dependency_is_rejected():
+    graph = StageGraph()
+    try:
+        graph.add_stage('build', lambda cancel: None, depends_on=['checkout'])
+    except ValueError as e:
+        assert 'checkout' in str(e)
+    else:
+        raise AssertionError('expected ValueError')
+
+
+def test_failure_cancels_running_siblings_without_waiting_for_them():
+    released = threading.Event()
+    cancelled = []
+
+    def slow(cancel):
+        released.wait(5)
+        return 'late'
+
+    def fail(cancel):
+        time.sleep(0.05)
+        raise StageFailed('registry unreachable')
+
+    graph = StageGraph(on_cancel=lambda: cancelled.append(True))
+    graph.add_stage('slow', slow)
+    graph.add_stage('check', fail)
+    graph.add_stage('build', lambda cancel: None, depends_on=['check'])
+
+    started = time.monotonic()
+    outcome = graph.run()
+    elapsed = time.monotonic() - started
+    released.set()
+
+    assert elapsed < 2
+    assert not outcome['ok']
+    assert outcome['failed_stage'] == 'check'
+    assert str(outcome['error']) == 'registry unreachable'
+    assert outcome['status'] == {'slow': 'cancelled', 'check': 'failed', 'build': 'cancelled'}
+    assert cancelled == [True]
+    assert 'slow' in outcome['timings']
+    assert outcome['critical_path'] == []
+
+
+def test_cancel_event_reaches_running_stages():
+    seen = threading.Event()
+
+    def watcher(cancel):
+        if cancel.wait(5):
+            seen.set()
+
+    def fail(cancel):
+        raise StageFailed('boom')
+
+    graph = StageGraph()
+    graph.add_stage('watcher', watcher)
+    graph.add_stage('fail', fail)
+    graph.run()
+
+    assert seen.wait(2)
+
+
+def test_on_cancel_is_not_called_when_nothing_is_left_running():
+    def fail(cancel):
+        raise StageFailed('boom')
+
+    cancelled = []
+    graph = StageGraph(on_cancel=lambda: cancelled.append(True))
+    graph.add_stage('fail', fail)
+
+    assert not graph.run()['ok']
+    assert cancelled == []
+
+
+def test_critical_path_follows_the_longest_chain():
+    graph = StageGraph()
+    graph.add_stage('checkout', lambda cancel: None)
+    graph.add_stage('lint', lambda cancel: None, depends_on=['checkout'])
+    graph.add_stage('build', lambda cancel: None, depends_on=['checkout'])
+    graph.add_stage('push', lambda cancel: None, depends_on=['build'])
+    graph.add_stage('docs', lambda cancel: None)
+    timings = {
+        'checkout': {'duration': 1.0},
+        'lint': {'duration': 2.0},
+        'build': {'duration': 3.0},
+        'push': {'duration': 1.5},
+        'docs': {'duration': 5.0},
+    }
+
+    assert graph.critical_path(timings) == ['checkout', 'build', 'push']
+    timings['docs']['duration'] = 7.0
+    assert graph.critical_path(timings) == ['docs']
+
+
+def test_critical_path_of_an_empty_graph():
+    assert StageGraph().critical_path({}) == []
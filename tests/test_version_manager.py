@@ -0,0 +1,78 @@
+import pytest
+
+import version_manager
+from version_manager import VersionManager
+
+
+class FakeGit:
+    def commit_hash(self):
+        return 'abcdef0123456789'
+
+    def current_branch(self):
+        return 'main'
+
+
+@pytest.fixture
+def manager(state, tmp_path, monkeypatch):
+    monkeypatch.setattr(version_manager, 'LEGACY_VERSIONS_FILE', str(tmp_path / 'missing.json'))
+    return VersionManager('Demo_App', 'someone', 'token', state=state)
+
+
+def add_versions(manager, count):
+    ids = []
+    for i in range(count):
+        version = manager.create_version(git_runner=FakeGit())
+        manager.update_version_status(version['version_id'], 'success' if i % 2 == 0 else 'failed')
+        ids.append(version['version_id'])
+    return ids
+
+
+def test_versions_in_the_same_second_get_distinct_ids(manager):
+    ids = add_versions(manager, 3)
+    assert len(set(ids)) == 3
+
+
+def test_cursor_walks_every_version_newest_first(manager):
+    ids = add_versions(manager, 7)
+
+    seen = []
+    cursor = None
+    pages = 0
+    while True:
+        page = manager.query_versions(cursor=cursor, limit=3)
+        seen.extend(v['version_id'] for v in page['versions'])
+        pages += 1
+        cursor = page['next_cursor']
+        if cursor is None:
+            break
+
+    assert seen == list(reversed(ids))
+    assert pages == 3
+
+
+def test_no_cursor_when_the_last_page_is_exactly_full(manager):
+    add_versions(manager, 4)
+    first = manager.query_versions(limit=2)
+    second = manager.query_versions(cursor=first['next_cursor'], limit=2)
+
+    assert first['next_cursor'] == first['versions'][-1]['version_id']
+    assert len(second['versions']) == 2
+    assert second['next_cursor'] is None
+
+
+def test_filters_apply_across_pages(manager):
+    ids = add_versions(manager, 6)
+    successes = [version_id for i, version_id in enumerate(ids) if i % 2 == 0]
+
+    first = manager.query_versions({'status': 'success'}, limit=2)
+    second = manager.query_versions({'status': 'success'}, cursor=first['next_cursor'], limit=2)
+
+    assert [v['version_id'] for v in first['versions'] + second['versions']] == list(reversed(successes))
+    assert second['next_cursor'] is None
+    assert manager.query_versions({'branch': 'develop'})['versions'] == []
+
+
+def test_unknown_cursor_is_an_error(manager):
+    add_versions(manager, 1)
+    with pytest.raises(ValueError):
+        manager.query_versions(cursor='v19700101_000000')
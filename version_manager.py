@@ -1,103 +1,140 @@
+import bisect
 import json
 import os
-import subprocess
 import shutil
+from contextlib import contextmanager
 from datetime import datetime
 from typing import Dict, List, Optional
 
+from git_runner import GitRunner
+from shared_state import SharedState, open_state
+
+# Statuses after which a version no longer changes and is counted in the stats
+TERMINAL_STATUSES = ('success', 'failed', 'cancelled', 'timed_out')
+
+# Key of the version history in the shared state; the JSON file it replaced is imported once
+VERSIONS_KEY = 'deployment_versions'
+LEGACY_VERSIONS_FILE = 'deployment_versions.json'
+
 class VersionManager:
-    def __init__(self, project_name: str, github_username: str, github_token: str):
+    def __init__(self, project_name: str, github_username: str, github_token: str,
+                 state: Optional[SharedState] = None):
         self.project_name = project_name
         self.github_username = github_username
         self.github_token = github_token
-        self.versions_file = 'deployment_versions.json'
+        self.state = state or open_state()
         self.load_versions()
     
     def load_versions(self):
         """Load existing version history"""
-        if os.path.exists(self.versions_file):
-            with open(self.versions_file, 'r') as f:
+        self.versions = self.state.get_document(VERSIONS_KEY)
+        if self.versions is None and os.path.exists(LEGACY_VERSIONS_FILE):
+            with open(LEGACY_VERSIONS_FILE, 'r') as f:
                 self.versions = json.load(f)
-        else:
+        if self.versions is None:
             self.versions = {
                 'project': self.project_name,
                 'deployments': [],
                 'current_version': None
             }
+        if 'stats' not in self.versions:
+            # History written before stats existed: build them once
+            self.rebuild_stats()
     
     def save_versions(self):
-        """Save version history to file"""
-        with open(self.versions_file, 'w') as f:
-            json.dump(self.versions, f, indent=2)
+        """Save version history to the shared state"""
+        self.state.put_document(VERSIONS_KEY, self.versions)
     
-    def create_version(self, version_type: str = 'auto') -> Dict:
+    @contextmanager
+    def _transaction(self):
+        """Reload, change and save the history as one write, so concurrent deploys in any worker process keep each other's updates"""
+        with self.state.transaction():
+            self.load_versions()
+            yield
+            self.save_versions()
+    
+    def create_version(self, version_type: str = 'auto', git_runner: Optional[GitRunner] = None) -> Dict:
         """Create a new version entry"""
-        timestamp = datetime.now().strftime('%Y%m%d_%H%M%S')
-        version_id = f"v{timestamp}"
-        
-        # Get current Git commit hash
+        # Get current Git commit hash and branch (one git process, shared with the caller's job)
+        git_runner = git_runner or GitRunner()
         try:
-            result = subprocess.run(['git', 'rev-parse', 'HEAD'], 
-                                 capture_output=True, text=True, check=True)
-            commit_hash = result.stdout.strip()[:8]
+            commit_hash = (git_runner.commit_hash() or "unknown")[:8]
+            branch = git_runner.current_branch()
         except:
             commit_hash = "unknown"
-        
-        # Get current branch
-        try:
-            result = subprocess.run(['git', 'branch', '--show-current'], 
-                                 capture_output=True, text=True, check=True)
-            branch = result.stdout.strip()
-        except:
             branch = "main"
         
-        version_info = {
-            'version_id': version_id,
-            'timestamp': datetime.now().isoformat(),
-            'type': version_type,  # 'auto', 'manual', 'rollback'
-            'commit_hash': commit_hash,
-            'branch': branch,
-            'github_repo': f"{self.github_username}/{self.project_name.lower().replace('_', '-')}",
-            'docker_image': f"ghcr.io/{self.github_username}/{self.project_name.lower().replace('_', '-')}:{version_id}",
-            'status': 'deploying',
-            'rollback_available': False,
-            'notes': ''
-        }
-        
-        self.versions['deployments'].append(version_info)
-        self.versions['current_version'] = version_id
-        self.save_versions()
+        with self._transaction():
+            timestamp = datetime.now().strftime('%Y%m%d_%H%M%S')
+            version_id = f"v{timestamp}"
+            # Another deploy may have started in the same second
+            existing = {v['version_id'] for v in self.versions['deployments']}
+            suffix = 2
+            while version_id in existing:
+                version_id = f"v{timestamp}_{suffix}"
+                suffix += 1
+            
+            version_info = {
+                'version_id': version_id,
+                'timestamp': datetime.now().isoformat(),
+                'type': version_type,  # 'auto', 'manual', 'rollback'
+                'commit_hash': commit_hash,
+                'branch': branch,
+                'github_repo': f"{self.github_username}/{self.project_name.lower().replace('_', '-')}",
+                'docker_image': f"ghcr.io/{self.github_username}/{self.project_name.lower().replace('_', '-')}:{version_id}",
+                'status': 'deploying',
+                'rollback_available': False,
+                'notes': '',
+                'project': self.project_name
+            }
+            
+            self.versions['deployments'].append(version_info)
+            self.versions['current_version'] = version_id
         
         return version_info
     
     def update_version_status(self, version_id: str, status: str, notes: str = ''):
         """Update version status"""
-        for version in self.versions['deployments']:
-            if version['version_id'] == version_id:
-                version['status'] = status
-                if notes:
-                    version['notes'] = notes
-                break
-        self.save_versions()
+        with self._transaction():
+            for version in self.versions['deployments']:
+                if version['version_id'] == version_id:
+                    was_terminal = version['status'] in TERMINAL_STATUSES
+                    version['status'] = status
+                    if notes:
+                        version['notes'] = notes
+                    if status in TERMINAL_STATUSES and not was_terminal:
+                        finished_at = datetime.now()
+                        version['finished_at'] = finished_at.isoformat()
+                        version['duration'] = round((finished_at - datetime.fromisoformat(version['timestamp'])).total_seconds(), 3)
+                        self._record_stats(version)
+                    break
     
+    def set_version_fields(self, version_id: str, fields: Dict):
+        """Store extra data (timings, digests, ...) on a version entry"""
+        with self._transaction():
+            for version in self.versions['deployments']:
+                if version['version_id'] == version_id:
+                    version.update(fields)
+                    break
+
     def mark_rollback_available(self, version_id: str):
         """Mark a version as available for rollback"""
-        for version in self.versions['deployments']:
-            if version['version_id'] == version_id:
-                version['rollback_available'] = True
-                break
-        self.save_versions()
+        with self._transaction():
+            for version in self.versions['deployments']:
+                if version['version_id'] == version_id:
+                    version['rollback_available'] = True
+                    break
     
     def get_available_rollbacks(self) -> List[Dict]:
         """Get list of versions available for rollback"""
         return [v for v in self.versions['deployments'] 
                 if v['rollback_available'] and v['status'] == 'success']
     
-    def rollback_to_version(self, target_version_id: str) -> Dict:
+    def rollback_to_version(self, target_version_id: str, git_runner: Optional[GitRunner] = None) -> Dict:
         """Rollback to a specific version"""
         # Create rollback version
-        rollback_version = self.create_version('rollback')
-        rollback_version['rollback_to'] = target_version_id
+        rollback_version = self.create_version('rollback', git_runner)
+        self.set_version_fields(rollback_version['version_id'], {'rollback_to': target_version_id})
         
         # Find target version
         target_version = None
@@ -123,6 +160,103 @@ class VersionManager:
         """Get recent version history"""
         return self.versions['deployments'][-limit:]
     
+    def query_versions(self, filters: Optional[Dict] = None, cursor: Optional[str] = None, limit: int = 20) -> Dict:
+        """Newest-first page of versions matching filters.
+
+        Filters: status, type, branch, project (exact match) and since/until
+        (ISO timestamps). The cursor is the version_id of the last entry of
+        the previous page.
+        """
+        filters = filters or {}
+        deployments = self.versions['deployments']
+        start = len(deployments) - 1
+        if cursor:
+            positions = {v['version_id']: i for i, v in enumerate(deployments)}
+            if cursor not in positions:
+                raise ValueError(f"Unknown cursor {cursor}")
+            start = positions[cursor] - 1
+        
+        page = []
+        next_cursor = None
+        for i in range(start, -1, -1):
+            version = deployments[i]
+            if not self._matches(version, filters):
+                continue
+            if len(page) == limit:
+                next_cursor = page[-1]['version_id']
+                break
+            page.append(version)
+        
+        return {'versions': page, 'next_cursor': next_cursor}
+    
+    def _matches(self, version: Dict, filters: Dict) -> bool:
+        for field in ('status', 'type', 'branch'):
+            if filters.get(field) and version.get(field) != filters[field]:
+                return False
+        if filters.get('project') and version.get('project', self.versions['project']) != filters['project']:
+            return False
+        if filters.get('since') and version['timestamp'] < filters['since']:
+            return False
+        if filters.get('until') and version['timestamp'] > filters['until']:
+            return False
+        return True
+    
+    def _record_stats(self, version: Dict):
+        """Fold one finished version into its project's running stats"""
+        project = version.get('project', self.versions['project'])
+        stats = self.versions['stats'].setdefault(project, {
+            'finished': 0,
+            'by_status': {},
+            'durations': [],
+            'cache_steps': 0,
+            'cache_hits': 0
+        })
+        stats['finished'] += 1
+        stats['by_status'][version['status']] = stats['by_status'].get(version['status'], 0) + 1
+        if version.get('duration') is not None:
+            # Kept sorted so percentiles are a lookup
+            bisect.insort(stats['durations'], version['duration'])
+        build_cache = version.get('build_cache') or {}
+        stats['cache_steps'] += build_cache.get('steps', 0)
+        stats['cache_hits'] += build_cache.get('cached', 0)
+    
+    def rebuild_stats(self):
+        """Recompute stats from the full history"""
+        self.versions['stats'] = {}
+        for version in self.versions['deployments']:
+            if version['status'] in TERMINAL_STATUSES:
+                self._record_stats(version)
+    
+    def get_stats(self, project: Optional[str] = None) -> Dict:
+        """Success rate, p50/p95 duration and build cache hit rate for a project"""
+        stats = self.versions['stats'].get(project or self.project_name)
+        if not stats:
+            return {'finished': 0, 'success_rate': None, 'p50_duration': None,
+                    'p95_duration': None, 'cache_hit_rate': None}
+        
+        def percentile(p):
+            durations = stats['durations']
+            if not durations:
+                return None
+            return durations[min(len(durations) - 1, int(round(p * (len(durations) - 1))))]
+        
+        return {
+            'finished': stats['finished'],
+            'by_status': stats['by_status'],
+            'success_rate': round(stats['by_status'].get('success', 0) / stats['finished'], 4),
+            'p50_duration': percentile(0.5),
+            'p95_duration': percentile(0.95),
+            'cache_hit_rate': round(stats['cache_hits'] / stats['cache_steps'], 4) if stats['cache_steps'] else None
+        }
+    
+    def get_last_successful_build(self) -> Optional[Dict]:
+        """Most recent successful non-rollback deploy of this project"""
+        for version in reversed(self.versions['deployments']):
+            if (version['status'] == 'success' and version['type'] != 'rollback'
+                    and version.get('project', self.versions['project']) == self.project_name):
+                return version
+        return None
+    
     def get_current_version(self) -> Optional[Dict]:
         """Get current version info"""
         if self.versions['current_version']:
@@ -133,7 +267,7 @@ class VersionManager:
     
     def cleanup_old_versions(self, keep_count: int = 5):
         """Clean up old versions, keeping only the most recent ones"""
-        if len(self.versions['deployments']) > keep_count:
-            # Keep the most recent versions
-            self.versions['deployments'] = self.versions['deployments'][-keep_count:]
-            self.save_versions() 
\ No newline at end of file
+        with self._transaction():
+            if len(self.versions['deployments']) > keep_count:
+                # Keep the most recent versions
+                self.versions['deployments'] = self.versions['deployments'][-keep_count:] 
\ No newline at end of file